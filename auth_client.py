@@ -0,0 +1,123 @@
+import os
+
+import httpx
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+Internal_API_KEY = os.getenv("INTERNAL_API_KEY")
+FASTAPI_SERVER_URL = os.getenv("FASTAPI_SERVER_URL")
+
+# --- Credential cache settings ---
+CREDS_CACHE_SIZE = int(os.environ.get("CREDS_CACHE_SIZE", 10000))
+CREDS_CACHE_TTL = int(os.environ.get("CREDS_CACHE_TTL", 1800))
+
+# user_id -> Credentials. The Credentials object refreshes its own access
+# token, so keeping it around is safe until Google rejects it.
+_creds_cache = TTLCache(maxsize=CREDS_CACHE_SIZE, ttl=CREDS_CACHE_TTL)
+
+_client = None
+
+
+def _get_client():
+    """One pooled client for the token server, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=FASTAPI_SERVER_URL or "",
+            headers={"X-API-KEY": Internal_API_KEY or ""},
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _is_usable(creds) -> bool:
+    # An expired token is only a problem if it can't be refreshed
+    return not (creds.expired and not creds.refresh_token)
+
+
+def invalidate_creds(user_id: int):
+    """Drops a user's cached credentials (e.g. after Google rejected them)."""
+    _creds_cache.pop(user_id, None)
+
+
+# The google-auth imports are deferred to the first use, to keep the bot's cold start fast
+
+def is_auth_error(err: Exception) -> bool:
+    """True if Google rejected the user's credentials."""
+    from google.auth.exceptions import RefreshError
+    if isinstance(err, RefreshError):
+        return True
+    resp = getattr(err, "resp", None)  # googleapiclient.errors.HttpError
+    return getattr(resp, "status", None) == 401
+
+
+async def get_creds_for_user(user_id: int):
+    """Returns the user's Google Credentials, or None if they haven't connected."""
+    creds = _creds_cache.get(user_id)
+    if creds is not None and _is_usable(creds):
+        return creds
+
+    from google.oauth2.credentials import Credentials
+    try:
+        response = await _get_client().get("/get-user-token", params={"user_id": user_id})
+        response.raise_for_status()
+
+        creds = Credentials(**response.json())
+        _creds_cache[user_id] = creds
+        return creds
+
+    except httpx.HTTPStatusError as http_err:
+        # This catches 4xx and 5xx errors
+        if http_err.response.status_code == 404:
+            print(f"Token not found for user {user_id}")
+        else:
+            print(f"HTTP error from token server: {http_err}")
+        return None
+
+    except httpx.RequestError as e:
+        # This catches network errors (connection, timeout, etc.)
+        print(f"Failed to connect to token server: {e}")
+        return None
+    except Exception as e:
+        # Catch any other unexpected errors
+        print(f"An unknown error occurred: {e}")
+        return None
+
+
+async def get_creds_for_users(user_ids, batch_size: int = 500):
+    """Returns {user_id: Credentials} for every user who has connected, using the batch endpoint."""
+    from google.oauth2.credentials import Credentials
+    result = {}
+    missing = []
+    for user_id in user_ids:
+        creds = _creds_cache.get(user_id)
+        if creds is not None and _is_usable(creds):
+            result[user_id] = creds
+        else:
+            missing.append(user_id)
+
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        try:
+            response = await _get_client().post("/get-user-tokens", json={"user_ids": batch})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Failed to fetch tokens in bulk: {e}")
+            continue
+
+        for user_id, token_data in response.json().items():
+            creds = Credentials(**token_data)
+            _creds_cache[int(user_id)] = creds
+            result[int(user_id)] = creds
+
+    return result
@@ -0,0 +1,89 @@
+import os
+import asyncio
+
+# --- Auto-pipelining settings ---
+# At most this many commands are sent in one pipeline
+AUTOPIPELINE_MAX_BATCH = int(os.environ.get("REDIS_AUTOPIPELINE_MAX_BATCH", 500))
+
+
+class AutoPipeline:
+    """
+    Sends the single Redis commands issued during one event loop iteration
+    in one pipeline (one round trip) instead of one round trip each.
+
+        value = await auto.hget(key, field)
+
+    Any redis.asyncio command works; each caller still gets its own result
+    (or exception). Blocking commands (XREADGROUP BLOCK, ...) and anything
+    that needs MULTI/WATCH must use the client directly.
+    """
+
+    def __init__(self, client, max_batch=AUTOPIPELINE_MAX_BATCH):
+        self.client = client
+        self.max_batch = max_batch
+        self._pending = []
+        self._scheduled = False
+        self._sending = set()
+        self.batches = self.commands = 0
+
+    def __getattr__(self, command):
+        if command.startswith("_"):
+            raise AttributeError(command)
+
+        async def call(*args, **kwargs):
+            return await self.execute(command, *args, **kwargs)
+        return call
+
+    async def execute(self, command, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((command, args, kwargs, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif not self._scheduled:
+            # Everything queued before the loop gets back to us goes in the same pipeline
+            self._scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        self._scheduled = False
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        self.batches += 1
+        self.commands += len(batch)
+        pipe = self.client.pipeline(transaction=False)
+        queued = []
+        for command, args, kwargs, future in batch:
+            try:
+                getattr(pipe, command)(*args, **kwargs)
+            except Exception as e:
+                # Rejected before sending (e.g. DataError on bad arguments): only this caller fails
+                self._resolve(future, e)
+                continue
+            queued.append(future)
+
+        if not queued:
+            return
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(queued)
+
+        for future, result in zip(queued, results):
+            self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future, result):
+        if future.done():
+            return  # the caller was cancelled
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
@@ -0,0 +1,178 @@
+"""
+Benchmark: delivering one broadcast through the rate-limited sender.
+
+A fake Bot stands in for Telegram: every send_message takes a simulated
+round trip (--latency-ms, +-50%), and every --flood-every-th call is
+answered with RetryAfter(--flood-seconds) instead. Two ways in:
+
+- send_one: N concurrent tasks calling Broadcaster.send_one directly;
+- outbox:   the messages are queued with outbox.enqueue and delivered by an
+            OutboxWorkerPool with N workers (in-process fakeredis).
+
+Both report throughput, per-message latency (send_one: one call; outbox:
+queued -> delivered), the outcomes, and how many chats got a message twice.
+
+    python benchmarks/bench_broadcast.py
+    python benchmarks/bench_broadcast.py --messages 1000 --rate 30 --workers 1 8 32
+    python benchmarks/bench_broadcast.py --modes outbox --latency-ms 300 --flood-every 50
+"""
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+from collections import Counter
+from statistics import median, quantiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")  # the client connects lazily, never to this
+os.environ.setdefault("PTB_TIMEDELTA", "1")
+
+from telegram.error import RetryAfter  # noqa: E402
+
+import bot_storage  # noqa: E402
+import outbox  # noqa: E402
+from broadcast import Broadcaster, TELEGRAM_MESSAGES_PER_SECOND  # noqa: E402
+from autopipeline import AutoPipeline  # noqa: E402
+
+
+class FakeBot:
+    """Just enough of telegram.Bot for Broadcaster.send_one."""
+
+    def __init__(self, latency: float, flood_every: int, flood_seconds: int, seed: int = 0):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.floods = 0
+        self.delivered = {}   # chat_id -> when
+        self.duplicates = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        self.calls += 1
+        if self.flood_every and self.calls % self.flood_every == 0:
+            self.floods += 1
+            raise RetryAfter(self.flood_seconds)
+        if chat_id in self.delivered:
+            self.duplicates += 1
+        self.delivered[chat_id] = time.perf_counter()
+
+
+def use_fakeredis():
+    """Points bot_storage (client, auto-pipeline and Lua scripts) at an in-process fakeredis."""
+    import fakeredis
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    bot_storage.r = client
+    bot_storage.auto = AutoPipeline(client)
+    for name in dir(bot_storage):
+        if name.startswith("_") and name.endswith("_script"):
+            lua = getattr(bot_storage, "_" + name[1:-len("_script")].upper() + "_LUA")
+            setattr(bot_storage, name, client.register_script(lua))
+    return client
+
+
+def emulate_blocking_reads():
+    """fakeredis answers XREADGROUP ... BLOCK right away; without a pause the idle workers would spin."""
+    read = bot_storage.outbox_read
+
+    async def blocking_read(consumer, stream_keys, count, block_ms):
+        messages = await read(consumer, stream_keys, count, block_ms)
+        if not messages:
+            await asyncio.sleep(0.01)  # Redis would wake the reader as soon as something is queued
+        return messages
+
+    bot_storage.outbox_read = blocking_read
+
+
+async def via_send_one(bot, sender, chat_ids, workers):
+    queue = asyncio.Queue()
+    for chat_id in chat_ids:
+        queue.put_nowait(chat_id)
+    outcomes, latencies = Counter(), []
+
+    async def worker():
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            started = time.perf_counter()
+            outcomes[await sender.send_one(bot, chat_id, "Contest starts in 1 hour!")] += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return outcomes, latencies
+
+
+async def via_outbox(bot, sender, chat_ids, workers, timeout):
+    client = use_fakeredis()
+    outbox.broadcaster = sender  # a fresh rate limit for every run
+    pool = outbox.OutboxWorkerPool(bot, workers=workers, name="bench")
+    with contextlib.redirect_stdout(io.StringIO()):
+        await pool.start()
+    queued = time.perf_counter()
+    await outbox.enqueue(chat_ids, "Contest starts in 1 hour!")
+
+    deadline = queued + timeout
+    while len(bot.delivered) < len(chat_ids) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await pool.stop()
+
+    outcomes = Counter(sent=len(bot.delivered))
+    outcomes["dead-lettered"] = await client.xlen(bot_storage.OUTBOX_DEAD_STREAM_KEY)
+    outcomes["still queued"] = len(chat_ids) - outcomes["sent"] - outcomes["dead-lettered"]
+    await client.aclose()
+    return outcomes, [at - queued for at in bot.delivered.values()]
+
+
+def report(mode, workers, elapsed, bot, outcomes, latencies):
+    ms = sorted(x * 1000 for x in latencies) or [0.0]
+    p95 = quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+    counts = ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items()) if v)
+    print(f"{mode:8} {workers:3d} workers | {len(bot.delivered) / elapsed:6.1f} msg/s | "
+          f"median {median(ms):8.1f} ms | p95 {p95:8.1f} ms | {bot.floods} RetryAfter | "
+          f"{bot.duplicates} duplicates | {counts}", flush=True)
+
+
+async def run(args):
+    if "outbox" in args.modes:
+        try:
+            import fakeredis  # noqa: F401
+        except ImportError:
+            print("The outbox mode needs fakeredis (pip install -r requirements-dev.txt).")
+            return 1
+        emulate_blocking_reads()
+
+    print(f"{args.messages} messages, rate limit {args.rate}/s, latency {args.latency_ms} ms, "
+          f"RetryAfter({args.flood_seconds}s) every {args.flood_every} calls\n")
+    chat_ids = list(range(1_000_000, 1_000_000 + args.messages))
+    for mode in args.modes:
+        for workers in args.workers:
+            bot = FakeBot(args.latency_ms / 1000, args.flood_every, args.flood_seconds)
+            sender = Broadcaster(rate=args.rate)
+            started = time.perf_counter()
+            if mode == "send_one":
+                outcomes, latencies = await via_send_one(bot, sender, chat_ids, workers)
+            else:
+                outcomes, latencies = await via_outbox(bot, sender, chat_ids, workers, args.timeout)
+            report(mode, workers, time.perf_counter() - started, bot, outcomes, latencies)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=TELEGRAM_MESSAGES_PER_SECOND, help="messages/second")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="simulated Bot API round trip")
+    parser.add_argument("--flood-every", type=int, default=100, help="every n-th call gets RetryAfter, 0 = never")
+    parser.add_argument("--flood-seconds", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", default=["send_one", "outbox"], choices=["send_one", "outbox"])
+    parser.add_argument("--timeout", type=float, default=300, help="outbox mode: give up after this many seconds")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
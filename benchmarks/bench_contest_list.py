@@ -0,0 +1,130 @@
+"""
+Benchmark: fetch_upcoming_contests() with the streaming parser vs. downloading
+and json.loads()-ing the whole contest.list body (what the bot did before).
+
+The body is served from a recorded contest.list fixture through an in-process
+httpx transport that sends it in chunks at a simulated bandwidth, so the
+numbers don't depend on Codeforces or the network.
+
+    python benchmarks/bench_contest_list.py
+    python benchmarks/bench_contest_list.py --bandwidth 2000 --runs 10
+    python benchmarks/bench_contest_list.py --record   # refresh the fixture from the live API
+"""
+import os
+import sys
+import gzip
+import time
+import asyncio
+import argparse
+import tracemalloc
+from statistics import median
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import cf_client  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "fixtures", "contest_list.json.gz")
+
+
+class ChunkedBody(httpx.AsyncByteStream):
+    """Sends `body` in `chunk_size` pieces at `bandwidth` KB/s, counting what was actually sent."""
+
+    def __init__(self, body: bytes, chunk_size: int, bandwidth: float):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.delay = chunk_size / (bandwidth * 1024) if bandwidth else 0
+        self.sent = 0
+
+    async def __aiter__(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            chunk = self.body[i:i + self.chunk_size]
+            self.sent += len(chunk)
+            yield chunk
+
+
+def make_client(body: bytes, chunk_size: int, bandwidth: float):
+    streams = []
+
+    def handler(request):
+        stream = ChunkedBody(body, chunk_size, bandwidth)
+        streams.append(stream)
+        return httpx.Response(200, headers={"Content-Type": "application/json"}, stream=stream)
+
+    client = cf_client.CodeforcesClient(rate=1000)
+    client._client = httpx.AsyncClient(base_url=cf_client.API_BASE_URL, transport=httpx.MockTransport(handler))
+    return client, streams
+
+
+async def full_download(client):
+    """The old way: the whole body, then json.loads, then filter."""
+    contests = await client.contest_list(gym=False)
+    upcoming = [c for c in contests if c["phase"] == "BEFORE"]
+    return sorted(upcoming, key=lambda x: x["startTimeSeconds"])
+
+
+async def streaming(client):
+    cf_client.client = client  # fetch_upcoming_contests uses the module's shared client
+    return await cf_client.fetch_upcoming_contests()
+
+
+async def measure(fn, body, chunk_size, bandwidth):
+    client, streams = make_client(body, chunk_size, bandwidth)
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = await fn(client)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await client.aclose()
+    return elapsed, peak, streams[0].sent, result
+
+
+async def run(args):
+    with gzip.open(args.fixture, "rb") as f:
+        body = f.read()
+    print(f"Fixture: {len(body) / 1024:.0f} KB, chunks of {args.chunk_size} B, "
+          f"bandwidth {'unlimited' if not args.bandwidth else f'{args.bandwidth} KB/s'}, {args.runs} runs\n")
+
+    results = {}
+    for name, fn in (("full download + json.loads", full_download), ("streaming parser", streaming)):
+        runs = [await measure(fn, body, args.chunk_size, args.bandwidth) for _ in range(args.runs)]
+        results[name] = runs[0][3]
+        print(f"{name:28} median {median(r[0] for r in runs) * 1000:8.1f} ms | "
+              f"read {runs[0][2] / 1024:6.0f} KB | peak memory {max(r[1] for r in runs) / 1024:7.0f} KB")
+
+    first, second = results.values()
+    if [c["id"] for c in first] != [c["id"] for c in second]:
+        print("\nMISMATCH: the two paths returned different contests!")
+        return 1
+    print(f"\nBoth returned the same {len(first)} upcoming contests.")
+    return 0
+
+
+def record(path):
+    response = httpx.get(f"{cf_client.API_BASE_URL}/contest.list", params={"gym": "false"},
+                         headers={"User-Agent": cf_client.USER_AGENT}, timeout=30)
+    response.raise_for_status()
+    with gzip.GzipFile(path, "wb", mtime=0) as f:
+        f.write(response.content)
+    print(f"Recorded {len(response.content) / 1024:.0f} KB to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=16 * 1024)
+    parser.add_argument("--bandwidth", type=float, default=1000, help="KB/s, 0 = unlimited")
+    parser.add_argument("--record", action="store_true", help="download contest.list into the fixture first")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.fixture)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark: how long the bot takes to start as the number of users grows.
+
+Times `import codeforces` (in a fresh interpreter) and the Redis steps of
+post_init, for a cold start (no prefs index, no subscriber registry snapshot:
+chunked HSCAN/SSCAN scans and an index rebuild) and a warm one (index and
+snapshot in place, what every restart after the first one does):
+
+- redis: check_connection (one PING);
+- prefs index: ensure_prefs_index;
+- subscribers: load_subscribers.
+
+    python benchmarks/bench_startup.py                     # in-process fakeredis
+    python benchmarks/bench_startup.py --redis-url redis://localhost:6379/15
+    python benchmarks/bench_startup.py --sizes 1000 10000 100000
+
+With --redis-url the script writes the bot's user keys in that database: it
+refuses to run if they already exist, and deletes them afterwards.
+Use a scratch database, never the production one.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import contextlib
+from statistics import median
+
+import redis.asyncio as aioredis
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")  # the client connects lazily, never to this
+import bot_storage  # noqa: E402
+import codeforces  # noqa: E402
+import contest_tags  # noqa: E402
+from autopipeline import AutoPipeline  # noqa: E402
+
+LABELS = list(contest_tags.LABELS.values())
+# Keys the bot must not already have in a --redis-url database
+GUARDED_KEYS = [bot_storage.SUBSCRIBERS_KEY, bot_storage.PREFS_KEY, bot_storage.REGISTRY_SNAPSHOT_KEY]
+
+
+def time_import(runs: int) -> float:
+    """Median time of `import codeforces` in a fresh interpreter, in milliseconds."""
+    code = "import time; t = time.perf_counter(); import codeforces; print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout
+        times.append(float(out.strip().splitlines()[-1]))
+    return median(times) * 1000
+
+
+def use_client(client):
+    """Points bot_storage (client, auto-pipeline and Lua scripts) at `client`."""
+    bot_storage.r = client
+    bot_storage.auto = AutoPipeline(client)
+    for name in dir(bot_storage):
+        if name.startswith("_") and name.endswith("_script"):
+            lua = getattr(bot_storage, "_" + name[1:-len("_script")].upper() + "_LUA")
+            setattr(bot_storage, name, client.register_script(lua))
+
+
+async def fill(client, size: int, existing: int, rng):
+    # About a third of users never set preferences
+    pipe = client.pipeline(transaction=False)
+    for user_id in range(existing, size):
+        pipe.sadd(bot_storage.SUBSCRIBERS_KEY, str(user_id))
+        if rng.random() > 0.33:
+            pipe.hset(bot_storage.PREFS_KEY, str(user_id), json.dumps(rng.sample(LABELS, rng.randint(1, 3))))
+        if len(pipe) >= 1000:
+            await pipe.execute()
+    await pipe.execute()
+
+
+async def clear_derived(client):
+    """Drops the prefs index and registry snapshot, as before the very first start."""
+    keys = [bot_storage.NO_PREFS_KEY, bot_storage.PREFS_INDEX_VERSION_KEY,
+            bot_storage.REGISTRY_SNAPSHOT_KEY, bot_storage.REGISTRY_DIRTY_KEY]
+    keys += [key async for key in client.scan_iter(match=f"{bot_storage.PREFS_INDEX_PREFIX}*")]
+    await client.delete(*keys)
+
+
+async def startup_steps():
+    """The Redis part of codeforces.post_init. Returns {step: milliseconds}."""
+    timings = {}
+    started = time.perf_counter()
+    for name, step in (("redis", bot_storage.check_connection),
+                       ("prefs index", codeforces.ensure_prefs_index),
+                       ("subscribers", codeforces.load_subscribers)):
+        with contextlib.redirect_stdout(io.StringIO()):  # the bot's own startup logging
+            await step()
+        now = time.perf_counter()
+        timings[name] = (now - started) * 1000
+        started = now
+    return timings
+
+
+async def run(args):
+    if args.redis_url:
+        client = aioredis.from_url(args.redis_url, decode_responses=True)
+        if await client.exists(*GUARDED_KEYS):
+            print(f"{args.redis_url} already has bot data ({', '.join(GUARDED_KEYS)}): use a scratch database.")
+            return 1
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            print("Install fakeredis (pip install -r requirements-dev.txt) or pass --redis-url.")
+            return 1
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    print(f"import codeforces: {time_import(args.import_runs):.0f} ms (median of {args.import_runs})\n")
+    use_client(client)
+    rng = random.Random(0)
+
+    print(f"{'users':>8} | {'start':5} | {'redis':>9} | {'prefs index':>11} | {'subscribers':>11} | {'total':>9}")
+    existing = 0
+    try:
+        for size in sorted(args.sizes):
+            await fill(client, size, existing, rng)
+            existing = size
+            await clear_derived(client)
+            for kind in ("cold", "warm"):
+                timings = await startup_steps()
+                print(f"{size:>8} | {kind:5} | {timings['redis']:7.1f}ms | {timings['prefs index']:9.1f}ms | "
+                      f"{timings['subscribers']:9.1f}ms | {sum(timings.values()):7.1f}ms", flush=True)
+    finally:
+        await clear_derived(client)
+        await client.delete(bot_storage.SUBSCRIBERS_KEY, bot_storage.PREFS_KEY)
+        await client.aclose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", help="a scratch Redis database (default: in-process fakeredis)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--import-runs", type=int, default=5)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
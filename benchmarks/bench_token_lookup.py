@@ -0,0 +1,115 @@
+"""
+Microbenchmark: looking up one user's Google token as the user_tokens hash grows.
+
+Compares server_storage.load_token_for_user (one HGET) and
+load_tokens_for_users (one HMGET for a batch) with the old way of loading
+the whole hash (load_tokens, HGETALL) and picking the user out of it.
+
+    python benchmarks/bench_token_lookup.py                     # in-process fakeredis
+    python benchmarks/bench_token_lookup.py --redis-url redis://localhost:6379/15
+    python benchmarks/bench_token_lookup.py --sizes 1000 10000 100000
+
+With --redis-url the script writes to the user_tokens key of that database:
+it refuses to run if the key already exists, and deletes it afterwards.
+Use a scratch database, never the production one.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from statistics import median
+
+import redis.asyncio as aioredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import server_storage  # noqa: E402
+from autopipeline import AutoPipeline  # noqa: E402
+
+
+def fake_token(user_id: int) -> str:
+    # Roughly the size and shape of what /oauth2callback stores
+    return json.dumps({
+        "token": f"ya29.{user_id:x}" + "a" * 180,
+        "refresh_token": f"1//0{user_id:x}" + "b" * 90,
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "client_id": "1234567890-abcdefghijklmnopqrstuvwxyz.apps.googleusercontent.com",
+        "client_secret": "GOCSPX-" + "c" * 28,
+        "scopes": ["https://www.googleapis.com/auth/calendar.events",
+                   "https://www.googleapis.com/auth/calendar.readonly"],
+    })
+
+
+async def fill(client, size: int, existing: int):
+    pipe = client.pipeline(transaction=False)
+    for user_id in range(existing, size):
+        pipe.hset(server_storage.TOKENS_KEY, str(user_id), fake_token(user_id))
+        if len(pipe) >= 1000:
+            await pipe.execute()
+    await pipe.execute()
+
+
+async def timed(fn, runs: int) -> float:
+    """Median time of `runs` calls, in milliseconds."""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - started)
+    return median(times) * 1000
+
+
+async def run(args):
+    if args.redis_url:
+        client = aioredis.from_url(args.redis_url, decode_responses=True)
+        if await client.exists(server_storage.TOKENS_KEY):
+            print(f"{server_storage.TOKENS_KEY} already exists in {args.redis_url}: use a scratch database.")
+            return 1
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            print("Install fakeredis (pip install -r requirements-dev.txt) or pass --redis-url.")
+            return 1
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    server_storage.r = client
+    server_storage.auto = AutoPipeline(client)
+    rng = random.Random(0)
+
+    print(f"{'users':>8} | {'HGET one':>10} | {'HMGET 100':>10} | {'HGETALL + pick':>15}")
+    existing = 0
+    try:
+        for size in sorted(args.sizes):
+            await fill(client, size, existing)
+            existing = size
+
+            async def one():
+                await server_storage.load_token_for_user(rng.randrange(size))
+
+            async def batch():
+                await server_storage.load_tokens_for_users(rng.sample(range(size), min(100, size)))
+
+            async def everything():
+                (await server_storage.load_tokens()).get(rng.randrange(size))
+
+            print(f"{size:>8} | {await timed(one, args.runs):8.3f}ms | {await timed(batch, args.runs):8.3f}ms | "
+                  f"{await timed(everything, max(3, args.runs // 20)):13.3f}ms")
+    finally:
+        await client.delete(server_storage.TOKENS_KEY)
+        await client.aclose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", help="a scratch Redis database (default: in-process fakeredis)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--runs", type=int, default=200)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Replays recorded Telegram updates into the bot's two update paths and reports
+how long each update takes from "Telegram has it" to "a handler sees it":
+
+- webhook: POSTed to server.telegram_webhook (through the FastAPI app, in-process);
+- polling: returned by a fake Bot API to the real PTB Updater's getUpdates long poll.
+
+The Bot API is simulated in-process (see FakeTelegram), with a configurable
+one-way network delay, so both paths pay the same network cost and only the
+way updates reach the bot differs. A probe handler runs before every other
+handler; the bot's own handlers aren't needed (nor Redis).
+
+    python benchmarks/replay_updates.py
+    python benchmarks/replay_updates.py --speed 1 --network-ms 40
+    python benchmarks/replay_updates.py --updates my_recording.json
+      (either {"updates": [{"at": seconds, "update": {...}}, ...]} or a plain
+       list of updates, e.g. getUpdates results; then message dates are used)
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from statistics import median, quantiles
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_WEBHOOK", "1")
+os.environ.setdefault("TELEGRAM_WEBHOOK_SECRET", "replay-secret")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, TypeHandler, ApplicationHandlerStop  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import server  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "fixtures", "telegram_updates.json")
+BOT_USER = {"id": 7000000000, "is_bot": True, "first_name": "CF Bot", "username": "cf_reminder_bot"}
+
+
+def load_updates(path):
+    """Returns [(seconds after the first update, update JSON), ...]."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return [(item["at"], item["update"]) for item in data["updates"]]
+
+    def date_of(update):
+        message = update.get("message") or update.get("callback_query", {}).get("message") or {}
+        return message.get("date", 0)
+    first = min(date_of(u) for u in data)
+    return [(date_of(u) - first, u) for u in data]
+
+
+class FakeTelegram(BaseRequest):
+    """
+    The Bot API, in-process. Updates "arrive at Telegram" on schedule; getUpdates
+    is a real long poll on them. Every response comes back after `network` seconds.
+    """
+
+    def __init__(self, network: float):
+        self.network = network
+        self.available = []
+        self.changed = asyncio.Event()
+
+    def publish(self, update):
+        self.available.append(update)
+        self.changed.set()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        await asyncio.sleep(self.network)  # request on its way to Telegram
+
+        if endpoint == "getUpdates":
+            offset, timeout = int(params.get("offset") or 0), float(params.get("timeout") or 0)
+            deadline = time.perf_counter() + timeout
+            while True:
+                self.available = [u for u in self.available if u["update_id"] >= offset]
+                if self.available or time.perf_counter() >= deadline:
+                    break
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    pass
+            result = list(self.available)
+        elif endpoint == "getMe":
+            result = BOT_USER
+        else:
+            result = True  # deleteWebhook, setMyCommands, ...
+
+        await asyncio.sleep(self.network)  # response on its way back
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def build_application(fake):
+    application = (
+        ApplicationBuilder()
+        .token("123456:REPLAY")
+        .request(fake)
+        .get_updates_request(fake)
+        .concurrent_updates(server.WEBHOOK_CONCURRENCY)
+        .build()
+    )
+    return application
+
+
+async def replay(mode, updates, speed, network):
+    fake = FakeTelegram(network)
+    application = build_application(fake)
+    arrived, latencies = {}, []
+    finished = asyncio.Event()
+
+    async def probe(update, context):
+        latencies.append(time.perf_counter() - arrived[update.update_id])
+        if len(latencies) == len(updates):
+            finished.set()
+        raise ApplicationHandlerStop
+
+    application.add_handler(TypeHandler(Update, probe), group=-1)
+    await application.initialize()
+    await application.start()
+
+    transport = httpx.ASGITransport(app=server.app)
+    http = httpx.AsyncClient(transport=transport, base_url="http://bot")
+    if mode == "polling":
+        await application.updater.start_polling(poll_interval=0, timeout=10) # type: ignore
+    else:
+        server.bot_application = application
+
+    async def post(update):
+        await asyncio.sleep(network)  # Telegram -> our server
+        response = await http.post(server.WEBHOOK_PATH, json=update,
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": server.WEBHOOK_SECRET})
+        response.raise_for_status()
+
+    started = time.perf_counter()
+    posts = []
+    for at, update in updates:
+        await asyncio.sleep(max(0.0, started + at / speed - time.perf_counter()))
+        arrived[update["update_id"]] = time.perf_counter()
+        if mode == "polling":
+            fake.publish(update)
+        else:
+            posts.append(asyncio.create_task(post(update)))
+
+    await asyncio.wait_for(finished.wait(), timeout=60)
+    await asyncio.gather(*posts)
+
+    if mode == "polling":
+        await application.updater.stop() # type: ignore
+    server.bot_application = None
+    await http.aclose()
+    await application.stop()
+    await application.shutdown()
+    return latencies
+
+
+def report(mode, latencies):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+    print(f"{mode:8} {len(ms):5d} updates | median {median(ms):7.2f} ms | p95 {p95:7.2f} ms | max {ms[-1]:7.2f} ms")
+
+
+async def main_async(args):
+    updates = sorted(load_updates(args.updates), key=lambda item: item[0])
+    duration = updates[-1][0] / args.speed
+    print(f"{len(updates)} updates over {duration:.1f}s per mode, one-way network delay {args.network_ms} ms\n")
+    for mode in args.modes:
+        report(mode, await replay(mode, updates, args.speed, args.network_ms / 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", default=FIXTURE)
+    parser.add_argument("--speed", type=float, default=5.0, help="replay this many times faster than recorded")
+    parser.add_argument("--network-ms", type=float, default=30.0, help="one-way delay between Telegram and the bot")
+    parser.add_argument("--modes", nargs="+", default=["webhook", "polling"], choices=["webhook", "polling"])
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
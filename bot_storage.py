@@ -1,93 +1,1202 @@
 import os
+import time
 import json
+import asyncio
 import redis
+import redis.asyncio as aioredis
+
+from autopipeline import AutoPipeline
 
 # --- Connect to Redis ---
 # Render will automatically provide this environment variable
 REDIS_URL = os.environ.get("REDIS_URL")
+# Connections shared by every coroutine of this process (blocking reads hold one each)
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
 
 if not REDIS_URL:
     print("WARNING: REDIS_URL not found. Defaulting to localhost.")
     REDIS_URL = "redis://localhost:6379"
 
-try:
-    # This (r) is your one connection to the Redis database
-    r = redis.from_url(REDIS_URL, decode_responses=True)
-    r.ping()
-    print("Connected to Redis successfully!")
-except redis.exceptions.ConnectionError as e: # type: ignore
-    print(f"FATAL: Could not connect to Redis. {e}")
-    print("Bot will not be able to save or load any data.")
-    # In a real app, you might exit, but here we'll let it continue
-    # so you can see other errors.
-    r = None # Set to None so other functions don't crash
+# This (r) is your one (async) connection pool to the Redis database.
+# Nothing connects until the first command, so importing this module is free;
+# check_connection() verifies Redis once the event loop is running.
+r = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, timeout=10, decode_responses=True
+))
+
+# Single commands issued at the same time share one round trip (see autopipeline.py)
+auto = AutoPipeline(r)
+
+
+async def check_connection() -> bool:
+    """Pings Redis once at startup. If it can't be reached, storage is disabled (r = None)."""
+    global r, auto
+    if not r: return False
+    try:
+        await r.ping()
+        print("Connected to Redis successfully!")
+        return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e: # type: ignore
+        print(f"FATAL: Could not connect to Redis. {e}")
+        print("Bot will not be able to save or load any data.")
+        # In a real app, you might exit, but here we'll let it continue
+        # so you can see other errors.
+        await r.aclose()
+        r = auto = None # Set to None so other functions don't crash
+        return False
 
 # --- Keys for your data ---
 # This is like naming your files
 PREFS_KEY = "user_prefs"
 SUBSCRIBERS_KEY = "subscribed_users"
-REMINDED_KEY = "reminded_contests"
+CONTESTS_KEY = "contest_cache"
+CONTEST_INDEX_KEY = "contest_index"           # contest_id -> contest JSON (upcoming and recent)
+CONTEST_INDEX_ENDS_KEY = "contest_index_ends" # contest_id scored by end time, for pruning
+CONTEST_VERSION_KEY = "contest_version"       # bumped whenever the contest list changes
+CONTEST_CHANGES_CHANNEL = "contest_changes"   # pub/sub: {"version", "changes"} (see contest_diff)
+# "New contest announced" opt-ins: tags per user, and one set of users per tag
+ANNOUNCE_KEY = "announce_prefs"
+ANNOUNCE_INDEX_PREFIX = "announce_index:"
+ANNOUNCE_ALL_KEY = "announce_index_all"       # users who want every announcement
+TIMEZONE_KEY_PREFIX = "user_tz:"
+CALENDAR_SYNC_PREFIX = "calendar_sync:"      # per user: contest_id -> synced fingerprint
+CALENDAR_SYNC_USERS_KEY = "calendar_sync_users"
+CALENDAR_SYNC_TTL = 60 * 24 * 3600
+# Inverted index: one set of user IDs per preference tag (see contest_tags.LABELS)
+PREFS_INDEX_PREFIX = "prefs_index:"
+NO_PREFS_KEY = "prefs_index_none"            # users with no preference (get everything)
+PREFS_INDEX_VERSION_KEY = "prefs_index_version"
+PREFS_INDEX_VERSION = "2"                    # bump to force a rebuild at startup
+# Per-user reminder lead times / quiet hours, and the users that have any
+REMINDER_SETTINGS_KEY = "user_reminder_settings"
+CUSTOM_REMINDER_USERS_KEY = "custom_reminder_users"
+# Timing wheel: one sorted set per minute slot + a sorted index of the non-empty slots
+WHEEL_SLOT_PREFIX = "reminder_wheel:"
+WHEEL_INDEX_KEY = "reminder_wheel_slots"
+WHEEL_PLANNED_KEY = "reminder_wheel_planned"  # contest_id -> start time its timers were planned for
+WHEEL_RESOLUTION = 60
+# Delivery ledger: one per broadcast (e.g. "<contest_id>:<offset>")
+LEDGER_PREFIX = "delivery:"
+LEDGER_RUNNING_KEY = "delivery_running"     # ledgers that haven't finished yet
+LEDGER_TTL = 3 * 24 * 3600
+# Outbox: outgoing Telegram messages, consumed by the worker pool in outbox.py
+OUTBOX_STREAM_KEY = "outbox"
+OUTBOX_GROUP = "senders"
+OUTBOX_DELAYED_KEY = "outbox_delayed"       # retries waiting for their backoff (score = ready time)
+OUTBOX_DEAD_STREAM_KEY = "outbox_dead"      # messages we gave up on, for inspection
+DEAD_CHATS_KEY = "dead_chats"               # chats that blocked the bot / no longer exist
+OUTBOX_MAXLEN = 1_000_000
+# Cluster: leader lock and live workers (score = last heartbeat)
+LEADER_KEY = "bot_leader"
+WORKERS_KEY = "bot_workers"
+# Pub/sub channel telling every process which locally cached entries changed
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+# Subscriber registry (see subscriber_registry.py): a compact snapshot, and the
+# users whose subscription/prefs changed since (score = time of the change)
+REGISTRY_SNAPSHOT_KEY = "subscriber_registry"
+REGISTRY_DIRTY_KEY = "subscriber_registry_dirty"
+REGISTRY_DIRTY_KEEP = 24 * 3600
 
 
 # --- Preference Functions (for user_prefs) ---
-def load_prefs():
-    """Loads user preferences (a dict) from Redis."""
-    if not r: return {} # No connection
+async def scan_prefs(batch: int = 1000):
+    """Yields user preferences a batch (dict) at a time (HSCAN), instead of one huge HGETALL."""
+    if not r: return # No connection
+    cursor = 0
+    while True:
+        try:
+            cursor, prefs_raw = await r.hscan(PREFS_KEY, cursor, count=batch) # type: ignore
+        except Exception as e:
+            print(f"Error scanning prefs in Redis: {e}")
+            return
+        yield {int(user_id): json.loads(prefs_json) for user_id, prefs_json in prefs_raw.items()}
+        if not cursor:
+            return
+
+# Swaps one user's prefs and their index entries in a single atomic step.
+# KEYS: prefs hash, no-prefs set. ARGV: user_id, new prefs (JSON list), index prefix.
+_SET_PREFS_LUA = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old then
+    for _, tag in ipairs(cjson.decode(old)) do
+        redis.call('SREM', ARGV[3] .. tag, ARGV[1])
+    end
+end
+redis.call('SREM', KEYS[2], ARGV[1])
+
+local new = cjson.decode(ARGV[2])
+if #new > 0 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    for _, tag in ipairs(new) do
+        redis.call('SADD', ARGV[3] .. tag, ARGV[1])
+    end
+else
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+return old
+"""
+_set_prefs_script = r.register_script(_SET_PREFS_LUA) if r else None
+
+async def set_user_prefs(user_id, prefs_list):
+    """Saves one user's preferences (and updates the index) without touching anyone else."""
+    if not r: return
+    try:
+        await _set_prefs_script(keys=[PREFS_KEY, NO_PREFS_KEY],
+                          args=[str(user_id), json.dumps(list(prefs_list)), PREFS_INDEX_PREFIX])
+        await publish_invalidation(PREFS_KEY, user_id)
+    except Exception as e:
+        print(f"Error saving prefs for {user_id} to Redis: {e}")
+
+async def delete_user_prefs(user_id):
+    """Removes one user's preferences (they go back to 'everything')."""
+    await set_user_prefs(user_id, [])
+
+async def get_user_prefs(user_id):
+    """Loads one user's preferences (a list), or [] if they have none."""
+    if not r: return []
+    try:
+        prefs_json = await auto.hget(PREFS_KEY, str(user_id))
+        return json.loads(prefs_json) if prefs_json else [] # type: ignore
+    except Exception as e:
+        print(f"Error loading prefs for {user_id} from Redis: {e}")
+        return []
+
+async def get_prefs_bulk(user_ids):
+    """Loads the preferences of many users with one HMGET. Returns {user_id: list}."""
+    user_ids = list(user_ids)
+    if not r or not user_ids: return {}
     try:
-        prefs_raw = r.hgetall(PREFS_KEY)
-        prefs = {}
-        for user_id, prefs_json in prefs_raw.items(): # type: ignore
-            prefs[int(user_id)] = json.loads(prefs_json)
-        return prefs
+        values = await auto.hmget(PREFS_KEY, [str(u) for u in user_ids])
+        return {int(u): json.loads(v) for u, v in zip(user_ids, values) if v} # type: ignore
     except Exception as e:
-        print(f"Error loading prefs from Redis: {e}")
+        print(f"Error loading prefs in bulk from Redis: {e}")
         return {}
 
-def save_prefs(prefs_dict):
-    """Saves the entire user preferences dict to Redis."""
+# --- Preference Index Functions (tag -> set of user IDs) ---
+def _index_key(tag: str) -> str:
+    return f"{PREFS_INDEX_PREFIX}{tag}"
+
+async def update_prefs_index(user_id, old_prefs, new_prefs):
+    """Moves one user from the index sets of old_prefs to those of new_prefs."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        for tag in old_prefs or []:
+            pipe.srem(_index_key(tag), str(user_id))
+        pipe.srem(NO_PREFS_KEY, str(user_id))
+
+        if new_prefs:
+            for tag in new_prefs:
+                pipe.sadd(_index_key(tag), str(user_id))
+        else:
+            pipe.sadd(NO_PREFS_KEY, str(user_id))
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error updating prefs index in Redis: {e}")
+
+async def rebuild_prefs_index(prefs_dict, subscribers):
+    """Rebuilds the whole index from scratch (used once, when it doesn't exist yet)."""
     if not r: return
     try:
         pipe = r.pipeline()
-        pipe.delete(PREFS_KEY) # Delete old hash
-        if prefs_dict:
-            # Convert values to JSON strings for storage
-            for user_id, prefs_list in prefs_dict.items():
+        async for key in r.scan_iter(match=f"{PREFS_INDEX_PREFIX}*"):
+            pipe.delete(key)
+        pipe.delete(NO_PREFS_KEY)
+
+        for user_id, prefs_list in prefs_dict.items():
+            # Store the normalized prefs too, so the hash and the index agree
+            if prefs_list:
                 pipe.hset(PREFS_KEY, str(user_id), json.dumps(prefs_list))
-            pipe.execute()
+            else:
+                pipe.hdel(PREFS_KEY, str(user_id))
+            for tag in prefs_list:
+                pipe.sadd(_index_key(tag), str(user_id))
+
+        no_prefs = [str(u) for u in subscribers if not prefs_dict.get(int(u))]
+        if no_prefs:
+            pipe.sadd(NO_PREFS_KEY, *no_prefs)
+        pipe.set(PREFS_INDEX_VERSION_KEY, PREFS_INDEX_VERSION)
+        await pipe.execute()
+        await publish_invalidation(PREFS_KEY)
+    except Exception as e:
+        print(f"Error rebuilding prefs index in Redis: {e}")
+
+async def prefs_index_exists() -> bool:
+    """True if the index has been built with the current tag scheme."""
+    if not r: return False
+    try:
+        return await auto.get(PREFS_INDEX_VERSION_KEY) == PREFS_INDEX_VERSION
+    except Exception as e:
+        print(f"Error checking prefs index in Redis: {e}")
+        return False
+
+async def get_subscribers_for_tags(tags, only_in=None, not_in=None) -> set:
+    """
+    Returns the IDs (ints) of subscribed users who either have no preference
+    or have at least one of `tags`: one SUNION + SINTER in a single round trip.
+    `only_in` / `not_in` further restrict the result to / exclude another set key.
+    Dead chats (see outbox_dead_letter) are always left out.
+    Returns None if Redis failed, so callers don't mistake it for "nobody".
+    """
+    if not r: return set()
+    tmp_key = f"{PREFS_INDEX_PREFIX}tmp:{os.getpid()}"
+    try:
+        pipe = r.pipeline()
+        pipe.sunionstore(tmp_key, [NO_PREFS_KEY] + [_index_key(t) for t in tags])
+        pipe.sinterstore(tmp_key, [tmp_key, SUBSCRIBERS_KEY] + ([only_in] if only_in else []))
+        pipe.sdiff([tmp_key, DEAD_CHATS_KEY] + ([not_in] if not_in else []))
+        pipe.delete(tmp_key)
+        members = (await pipe.execute())[-2]
+        return {int(u) for u in members}
     except Exception as e:
-        print(f"Error saving prefs to Redis: {e}")
+        print(f"Error reading prefs index from Redis: {e}")
+        return None
+
 
 # --- Set Functions (for subscribers and reminders) ---
-def load_set_from_file(redis_key: str) -> set:
+async def load_set_from_file(redis_key: str) -> set:
     """Loads a set from Redis."""
     if not r: return set()
     try:
-        return r.smembers(redis_key) # type: ignore
+        return await auto.smembers(redis_key) # type: ignore
     except Exception as e:
         print(f"Error loading set {redis_key} from Redis: {e}")
         return set()
 
-def add_to_set_file(item, redis_key: str):
+async def scan_set(redis_key: str, batch: int = 1000):
+    """Yields the members of a set a batch (list) at a time (SSCAN), for sets that grow with the user base."""
+    if not r: return
+    cursor = 0
+    while True:
+        try:
+            cursor, members = await r.sscan(redis_key, cursor, count=batch) # type: ignore
+        except Exception as e:
+            print(f"Error scanning set {redis_key} in Redis: {e}")
+            return
+        if members:
+            yield members
+        if not cursor:
+            return
+
+async def add_to_set_file(item, redis_key: str):
     """Adds a single item to a set in Redis."""
     if not r: return
     try:
-        r.sadd(redis_key, str(item))
+        await auto.sadd(redis_key, str(item))
+        await publish_invalidation(redis_key, item)
     except Exception as e:
         print(f"Error adding to set {redis_key}: {e}")
 
-def remove_from_set_file(item, redis_key: str):
+async def remove_from_set_file(item, redis_key: str):
     """Removes a single item from a set in Redis."""
     if not r: return
     try:
-        r.srem(redis_key, str(item))
+        await auto.srem(redis_key, str(item))
+        await publish_invalidation(redis_key, item)
     except Exception as e:
         print(f"Error removing from set {redis_key}: {e}")
 
-def is_in_set_file(item, redis_key: str) -> bool:
+async def is_in_set_file(item, redis_key: str) -> bool:
     """Checks if an item is in a set in Redis."""
     if not r: return False
     try:
-        return r.sismember(redis_key, str(item)) # type: ignore
+        return await auto.sismember(redis_key, str(item)) # type: ignore
     except Exception as e:
         print(f"Error checking set {redis_key}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+# --- Contest Cache Functions (shared contest.list snapshot) ---
+async def load_contest_snapshot():
+    """Loads the shared contest snapshot (a dict) from Redis, or None."""
+    if not r: return None
+    try:
+        snapshot_json = await auto.get(CONTESTS_KEY)
+        return json.loads(snapshot_json) if snapshot_json else None # type: ignore
+    except Exception as e:
+        print(f"Error loading contest snapshot from Redis: {e}")
+        return None
+
+async def save_contest_snapshot(snapshot, ttl_seconds: int):
+    """Saves the contest snapshot to Redis so every bot process can reuse it."""
+    if not r: return
+    try:
+        await auto.set(CONTESTS_KEY, json.dumps(snapshot), ex=ttl_seconds)
+    except Exception as e:
+        print(f"Error saving contest snapshot to Redis: {e}")
+
+
+# --- Subscriber Registry Functions ---
+async def scan_subscribers_with_prefs(batch: int = 1000):
+    """Yields lists of (user_id, prefs list) for every subscriber (SSCAN + HMGET, batch by batch)."""
+    if not r: return
+    cursor = 0
+    while True:
+        try:
+            cursor, members = await r.sscan(SUBSCRIBERS_KEY, cursor, count=batch) # type: ignore
+            prefs = await auto.hmget(PREFS_KEY, members) if members else []
+        except Exception as e:
+            print(f"Error scanning subscribers in Redis: {e}")
+            return
+        yield [(int(u), json.loads(p) if p else []) for u, p in zip(members, prefs)] # type: ignore
+        if not cursor:
+            return
+
+async def load_registry_snapshot():
+    """Returns (saved_at, snapshot text) of the subscriber registry, or None."""
+    if not r: return None
+    try:
+        snapshot_json = await auto.get(REGISTRY_SNAPSHOT_KEY)
+        if not snapshot_json:
+            return None
+        snapshot = json.loads(snapshot_json) # type: ignore
+        return snapshot["saved_at"], snapshot["data"]
+    except Exception as e:
+        print(f"Error loading subscriber registry snapshot from Redis: {e}")
+        return None
+
+async def save_registry_snapshot(data: str, saved_at: float):
+    """Saves the registry snapshot and forgets changes it already contains."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        pipe.set(REGISTRY_SNAPSHOT_KEY, json.dumps({"saved_at": saved_at, "data": data}))
+        pipe.zremrangebyscore(REGISTRY_DIRTY_KEY, "-inf", time.time() - REGISTRY_DIRTY_KEEP)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error saving subscriber registry snapshot to Redis: {e}")
+
+async def registry_changed_since(since: float):
+    """IDs (ints) of users whose subscription or prefs changed after `since`."""
+    if not r: return []
+    try:
+        return [int(u) for u in await auto.zrangebyscore(REGISTRY_DIRTY_KEY, since, "+inf")] # type: ignore
+    except Exception as e:
+        print(f"Error loading subscriber registry changes from Redis: {e}")
+        return []
+
+
+# --- Contest Version / Change Functions ---
+async def next_contest_version() -> int:
+    """A new, increasing contest snapshot version, shared by every process."""
+    if not r: return int(time.time())
+    try:
+        return await auto.incr(CONTEST_VERSION_KEY) # type: ignore
+    except Exception as e:
+        print(f"Error bumping contest version in Redis: {e}")
+        return int(time.time())
+
+async def publish_contest_changes(version: int, changes: dict):
+    """Tells every process what changed in the contest list with `version`."""
+    if not r: return
+    try:
+        await auto.publish(CONTEST_CHANGES_CHANNEL, json.dumps({"version": version, "changes": changes}))
+    except Exception as e:
+        print(f"Error publishing contest changes: {e}")
+
+
+# --- Announcement Opt-in Functions ---
+def _announce_key(tag: str) -> str:
+    return f"{ANNOUNCE_INDEX_PREFIX}{tag}"
+
+async def get_announce_tags(user_id):
+    """Returns the user's announcement tags ([] = everything), or None if they didn't opt in."""
+    if not r: return None
+    try:
+        tags_json = await auto.hget(ANNOUNCE_KEY, str(user_id))
+        return json.loads(tags_json) if tags_json is not None else None # type: ignore
+    except Exception as e:
+        print(f"Error loading announcement prefs for {user_id}: {e}")
+        return None
+
+async def set_announce_tags(user_id, tags):
+    """Opts a user in for announcements of `tags` ([] = everything), or out with None."""
+    if not r: return
+    try:
+        old = await get_announce_tags(user_id)
+        pipe = r.pipeline()
+        for tag in old or []:
+            pipe.srem(_announce_key(tag), str(user_id))
+        pipe.srem(ANNOUNCE_ALL_KEY, str(user_id))
+
+        if tags is None:
+            pipe.hdel(ANNOUNCE_KEY, str(user_id))
+        else:
+            pipe.hset(ANNOUNCE_KEY, str(user_id), json.dumps(list(tags)))
+            if tags:
+                for tag in tags:
+                    pipe.sadd(_announce_key(tag), str(user_id))
+            else:
+                pipe.sadd(ANNOUNCE_ALL_KEY, str(user_id))
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error saving announcement prefs for {user_id}: {e}")
+
+async def get_announce_subscribers(tags) -> set:
+    """
+    IDs (ints) of subscribed users who want announcements for any of `tags`:
+    one SUNION + SINTER with the subscribers (so unsubscribed chats are left out).
+    Returns None if Redis failed.
+    """
+    if not r: return set()
+    tmp_key = f"{ANNOUNCE_INDEX_PREFIX}tmp:{os.getpid()}"
+    try:
+        pipe = r.pipeline()
+        pipe.sunionstore(tmp_key, [ANNOUNCE_ALL_KEY] + [_announce_key(t) for t in tags])
+        pipe.sinterstore(tmp_key, [tmp_key, SUBSCRIBERS_KEY])
+        pipe.sdiff([tmp_key, DEAD_CHATS_KEY])
+        pipe.delete(tmp_key)
+        members = (await pipe.execute())[-2]
+        return {int(u) for u in members}
+    except Exception as e:
+        print(f"Error loading announcement subscribers: {e}")
+        return None
+
+
+# --- Contest Index Functions (contest by ID, for button presses) ---
+async def contest_index_put(contests, keep_after: float):
+    """Adds/updates contests in the index and drops the ones that ended before `keep_after`."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        if contests:
+            pipe.hset(CONTEST_INDEX_KEY, mapping={str(c["id"]): json.dumps(c) for c in contests})
+            pipe.zadd(CONTEST_INDEX_ENDS_KEY,
+                      {str(c["id"]): c["startTimeSeconds"] + c["durationSeconds"] for c in contests})
+        pipe.zrangebyscore(CONTEST_INDEX_ENDS_KEY, "-inf", keep_after)
+        expired = (await pipe.execute())[-1]
+        if expired:
+            pipe = r.pipeline()
+            pipe.hdel(CONTEST_INDEX_KEY, *expired)
+            pipe.zrem(CONTEST_INDEX_ENDS_KEY, *expired)
+            await pipe.execute()
+    except Exception as e:
+        print(f"Error updating contest index in Redis: {e}")
+
+async def contest_index_get(contest_id):
+    """Returns one contest (a dict) from the index, or None."""
+    if not r: return None
+    try:
+        contest_json = await auto.hget(CONTEST_INDEX_KEY, str(contest_id))
+        return json.loads(contest_json) if contest_json else None # type: ignore
+    except Exception as e:
+        print(f"Error loading contest {contest_id} from Redis: {e}")
+        return None
+
+
+# --- Timezone Cache Functions ---
+async def get_cached_timezone(user_id):
+    """Returns (timezone, seconds_left) for a user, or (None, 0) if not cached."""
+    if not r: return None, 0
+    try:
+        pipe = r.pipeline()
+        pipe.get(f"{TIMEZONE_KEY_PREFIX}{user_id}")
+        pipe.ttl(f"{TIMEZONE_KEY_PREFIX}{user_id}")
+        time_zone, ttl_left = await pipe.execute()
+        return time_zone, max(ttl_left or 0, 0)
+    except Exception as e:
+        print(f"Error loading timezone for {user_id} from Redis: {e}")
+        return None, 0
+
+async def cache_timezone(user_id, time_zone: str, ttl_seconds: int):
+    """Caches a user's calendar timezone in Redis."""
+    if not r: return
+    try:
+        await auto.set(f"{TIMEZONE_KEY_PREFIX}{user_id}", time_zone, ex=ttl_seconds)
+    except Exception as e:
+        print(f"Error saving timezone for {user_id} to Redis: {e}")
+
+
+# --- Calendar Sync Functions ---
+async def get_synced_events(user_id) -> dict:
+    """Returns {contest_id: fingerprint} of the contests already in the user's calendar."""
+    if not r: return {}
+    try:
+        return await auto.hgetall(f"{CALENDAR_SYNC_PREFIX}{user_id}") # type: ignore
+    except Exception as e:
+        print(f"Error loading synced events for {user_id} from Redis: {e}")
+        return {}
+
+async def save_synced_events(user_id, synced: dict):
+    """Records contests pushed to the user's calendar (only the ones that changed)."""
+    if not r or not synced: return
+    try:
+        key = f"{CALENDAR_SYNC_PREFIX}{user_id}"
+        pipe = r.pipeline()
+        pipe.hset(key, mapping=synced)
+        pipe.expire(key, CALENDAR_SYNC_TTL)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error saving synced events for {user_id} to Redis: {e}")
+
+
+# --- Reminder Settings Functions ---
+async def get_reminder_settings_bulk(user_ids) -> dict:
+    """Loads reminder settings of many users with one HMGET. Returns {user_id: dict}."""
+    user_ids = list(user_ids)
+    if not r or not user_ids: return {}
+    try:
+        values = await auto.hmget(REMINDER_SETTINGS_KEY, [str(u) for u in user_ids])
+        return {int(u): json.loads(v) for u, v in zip(user_ids, values) if v} # type: ignore
+    except Exception as e:
+        print(f"Error loading reminder settings from Redis: {e}")
+        return {}
+
+async def get_reminder_settings(user_id):
+    """Loads one user's reminder settings (a dict), or None if they use the defaults."""
+    return (await get_reminder_settings_bulk([user_id])).get(int(user_id))
+
+async def set_reminder_settings(user_id, settings):
+    """Saves one user's reminder settings; None/empty goes back to the defaults."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        if settings:
+            pipe.hset(REMINDER_SETTINGS_KEY, str(user_id), json.dumps(settings))
+            pipe.sadd(CUSTOM_REMINDER_USERS_KEY, str(user_id))
+        else:
+            pipe.hdel(REMINDER_SETTINGS_KEY, str(user_id))
+            pipe.srem(CUSTOM_REMINDER_USERS_KEY, str(user_id))
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error saving reminder settings for {user_id} to Redis: {e}")
+
+async def get_cached_timezones(user_ids) -> dict:
+    """Returns {user_id: timezone} for the users whose timezone is cached (one MGET)."""
+    user_ids = list(user_ids)
+    if not r or not user_ids: return {}
+    try:
+        values = await auto.mget([f"{TIMEZONE_KEY_PREFIX}{u}" for u in user_ids])
+        return {u: tz for u, tz in zip(user_ids, values) if tz} # type: ignore
+    except Exception as e:
+        print(f"Error loading timezones from Redis: {e}")
+        return {}
+
+
+# --- Timing Wheel Functions ---
+# Timers are bucketed by minute: inserting is one ZADD into a small slot,
+# expiring pops a whole slot at once. Slots live in Redis, so a restarted
+# process just continues from the slot index.
+def _slot_key(slot: int) -> str:
+    return f"{WHEEL_SLOT_PREFIX}{slot}"
+
+async def wheel_add(timers):
+    """Adds [(fire_at, member), ...] to the wheel. Re-adding the same member is a no-op."""
+    if not r or not timers: return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for fire_at, member in timers:
+            slot = int(fire_at) // WHEEL_RESOLUTION
+            pipe.zadd(_slot_key(slot), {member: fire_at})
+            pipe.zadd(WHEEL_INDEX_KEY, {str(slot): slot})
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error adding timers to Redis: {e}")
+
+async def wheel_due(now: float):
+    """
+    Returns [(member, fire_at), ...] of every slot that is due, without removing
+    them: call wheel_ack() once they are handled, so a crash in between doesn't lose any.
+    """
+    if not r: return []
+    try:
+        due_slots = await auto.zrangebyscore(WHEEL_INDEX_KEY, "-inf", int(now) // WHEEL_RESOLUTION)
+        if not due_slots:
+            return []
+
+        pipe = r.pipeline(transaction=False)
+        for slot in due_slots: # type: ignore
+            pipe.zrange(_slot_key(int(slot)), 0, -1, withscores=True)
+        timers = []
+        for slot_timers in await pipe.execute():
+            timers.extend((member, int(fire_at)) for member, fire_at in slot_timers)
+        return timers
+    except Exception as e:
+        print(f"Error reading due timers from Redis: {e}")
+        return []
+
+# Removes handled timers from one slot, and the slot from the index once it's empty
+# (timers added to the slot in the meantime stay). KEYS: wheel index, slot. ARGV: slot, members...
+_WHEEL_ACK_LUA = """
+if #ARGV > 1 then
+    redis.call('ZREM', KEYS[2], unpack(ARGV, 2))
+end
+if redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+end
+"""
+_wheel_ack_script = r.register_script(_WHEEL_ACK_LUA) if r else None
+
+async def wheel_ack(timers):
+    """Removes handled [(member, fire_at), ...] (as returned by wheel_due) from the wheel."""
+    if not r or not timers: return
+    by_slot = {}
+    for member, fire_at in timers:
+        by_slot.setdefault(int(fire_at) // WHEEL_RESOLUTION, []).append(member)
+    try:
+        for slot, members in by_slot.items():
+            for i in range(0, len(members), 1000):  # keeps unpack() within Lua's stack limit
+                await _wheel_ack_script(keys=[WHEEL_INDEX_KEY, _slot_key(slot)], args=[slot, *members[i:i + 1000]])
+    except Exception as e:
+        print(f"Error removing handled timers from Redis: {e}")
+
+async def get_planned_starts() -> dict:
+    """Returns {contest_id: start} of the contests whose timers are already planned."""
+    if not r: return {}
+    try:
+        return {int(c): int(s) for c, s in (await auto.hgetall(WHEEL_PLANNED_KEY)).items()} # type: ignore
+    except Exception as e:
+        print(f"Error loading planned contests from Redis: {e}")
+        return {}
+
+async def set_planned_starts(planned: dict, removed=()):
+    """Records {contest_id: start} as planned and forgets contests in `removed`."""
+    if not r or not (planned or removed): return
+    try:
+        pipe = r.pipeline()
+        if planned:
+            pipe.hset(WHEEL_PLANNED_KEY, mapping={str(c): s for c, s in planned.items()})
+        if removed:
+            pipe.hdel(WHEEL_PLANNED_KEY, *[str(c) for c in removed])
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error saving planned contests to Redis: {e}")
+
+
+# --- Delivery Ledger Functions ---
+# delivery:<id>             hash: status (running/done), text, total
+# delivery:<id>:recipients  list: the recipients, fixed when the broadcast starts
+# delivery:<id>:done        set:  recipients already handled (the per-user checkpoint)
+def _ledger_keys(ledger_id):
+    key = f"{LEDGER_PREFIX}{ledger_id}"
+    return key, f"{key}:recipients", f"{key}:done"
+
+async def ledger_status_many(ledger_ids) -> dict:
+    """Returns {ledger_id: 'running' | 'done' | None} in one round trip."""
+    ledger_ids = list(ledger_ids)
+    if not r or not ledger_ids: return {}
+    try:
+        pipe = r.pipeline(transaction=False)
+        for ledger_id in ledger_ids:
+            pipe.hget(_ledger_keys(ledger_id)[0], "status")
+        return dict(zip(ledger_ids, await pipe.execute()))
+    except Exception as e:
+        print(f"Error loading delivery ledgers from Redis: {e}")
+        return {}
+
+async def ledger_status(ledger_id):
+    return (await ledger_status_many([ledger_id])).get(ledger_id)
+
+async def ledger_begin(ledger_id, recipients, text: str) -> bool:
+    """
+    Records the recipients and message of a broadcast before the first send.
+    Returns False if the ledger already exists (another worker started it),
+    None if Redis failed (nothing was recorded).
+    """
+    if not r: return True
+    key, recipients_key, done_key = _ledger_keys(ledger_id)
+    try:
+        async with r.pipeline() as pipe:
+            # WATCH makes "create if missing" atomic across workers
+            await pipe.watch(key)
+            if await pipe.exists(key):
+                await pipe.unwatch()
+                return False
+            pipe.multi()
+            pipe.delete(recipients_key, done_key)
+            for i in range(0, len(recipients), 1000):
+                pipe.rpush(recipients_key, *recipients[i:i + 1000])
+            pipe.hset(key, mapping={"status": "running", "text": text, "total": len(recipients)})
+            for k in (key, recipients_key, done_key):
+                pipe.expire(k, LEDGER_TTL)
+            pipe.sadd(LEDGER_RUNNING_KEY, ledger_id)
+            await pipe.execute()
+        return True
+    except redis.exceptions.WatchError: # type: ignore
+        return False
+    except Exception as e:
+        print(f"Error starting delivery ledger {ledger_id}: {e}")
+        return None
+
+async def ledger_load(ledger_id):
+    """Returns {"status", "text", "recipients", "done"} of a ledger, or None."""
+    if not r: return None
+    key, recipients_key, done_key = _ledger_keys(ledger_id)
+    try:
+        pipe = r.pipeline()
+        pipe.hgetall(key)
+        pipe.lrange(recipients_key, 0, -1)
+        pipe.smembers(done_key)
+        meta, recipients, done = await pipe.execute()
+        if not meta:
+            return None
+        return {
+            "status": meta.get("status"),
+            "text": meta.get("text", ""),
+            "recipients": [int(u) for u in recipients],
+            "done": {int(u) for u in done},
+        }
+    except Exception as e:
+        print(f"Error loading delivery ledger {ledger_id}: {e}")
+        return None
+
+# Counts one final delivery outcome (sent/blocked/rejected/failed) on the ledger hash.
+# KEYS: ledger hash. ARGV: outcome. Returns {handled, total}, or nil once the ledger expired.
+_LEDGER_OUTCOME_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+local handled = redis.call('HINCRBY', KEYS[1], 'handled', 1)
+return {handled, tonumber(redis.call('HGET', KEYS[1], 'total') or 0)}
+"""
+_ledger_outcome_script = r.register_script(_LEDGER_OUTCOME_LUA) if r else None
+
+async def ledger_record_outcome(ledger_id, outcome: str):
+    """Counts one delivered (or given up) message of a broadcast. Returns (handled, total), or None."""
+    if not r: return None
+    try:
+        result = await _ledger_outcome_script(keys=[_ledger_keys(ledger_id)[0]], args=[outcome])
+        return (int(result[0]), int(result[1])) if result else None
+    except Exception as e:
+        print(f"Error updating delivery ledger {ledger_id}: {e}")
+        return None
+
+async def ledger_progress(ledger_id) -> dict:
+    """Returns {"sent", "blocked", "rejected", "failed", "total"} of a broadcast so far."""
+    fields = ["sent", "blocked", "rejected", "failed", "total"]
+    if not r: return dict.fromkeys(fields, 0)
+    try:
+        values = await auto.hmget(_ledger_keys(ledger_id)[0], fields)
+        return {f: int(v or 0) for f, v in zip(fields, values)} # type: ignore
+    except Exception as e:
+        print(f"Error loading delivery ledger {ledger_id}: {e}")
+        return dict.fromkeys(fields, 0)
+
+async def ledger_finish(ledger_id):
+    """Marks a broadcast as done and drops its per-user progress."""
+    if not r: return
+    key, recipients_key, done_key = _ledger_keys(ledger_id)
+    try:
+        pipe = r.pipeline()
+        pipe.hset(key, "status", "done")
+        pipe.hdel(key, "text")
+        pipe.delete(recipients_key, done_key)
+        pipe.srem(LEDGER_RUNNING_KEY, ledger_id)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error finishing delivery ledger {ledger_id}: {e}")
+
+async def ledger_forget_running(ledger_ids):
+    """Drops ledgers that expired before they could finish from the running set."""
+    if not r or not ledger_ids: return
+    try:
+        await auto.srem(LEDGER_RUNNING_KEY, *ledger_ids)
+    except Exception as e:
+        print(f"Error cleaning delivery ledgers: {e}")
+
+
+# --- Outbox Functions (Redis Streams of outgoing messages, one per shard) ---
+def outbox_stream_key(shard: int) -> str:
+    return f"{OUTBOX_STREAM_KEY}:{shard}"
+
+async def outbox_ensure_groups(stream_keys):
+    """Creates the streams and their consumer group if they don't exist yet."""
+    if not r: return
+    for stream_key in stream_keys:
+        try:
+            await auto.xgroup_create(stream_key, OUTBOX_GROUP, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e: # type: ignore
+            if "BUSYGROUP" not in str(e):
+                print(f"Error creating outbox consumer group: {e}")
+        except Exception as e:
+            print(f"Error creating outbox consumer group: {e}")
+
+async def outbox_enqueue(batches: dict, text: str, parse_mode: str = "Markdown", ledger_id=None):
+    """
+    Queues one message per chat; `batches` is {stream_key: [chat_id, ...]}.
+    With `ledger_id`, the chats are checkpointed in that delivery ledger in the
+    same transaction, so a batch is either queued and recorded, or neither.
+    Returns False if it wasn't.
+    """
+    if not r or not batches: return True
+    try:
+        pipe = r.pipeline()
+        for stream_key, chat_ids in batches.items():
+            for chat_id in chat_ids:
+                fields = {"chat_id": str(chat_id), "text": text, "parse_mode": parse_mode or "", "attempts": 0}
+                if ledger_id:
+                    fields["ledger_id"] = ledger_id  # for the progress counters
+                pipe.xadd(stream_key, fields, maxlen=OUTBOX_MAXLEN, approximate=True)
+            if ledger_id and chat_ids:
+                pipe.sadd(_ledger_keys(ledger_id)[2], *[str(c) for c in chat_ids])
+        await pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Error queueing messages in the outbox: {e}")
+        return False
+
+async def outbox_read(consumer: str, stream_keys, count: int, block_ms: int):
+    """Reads new messages for this consumer. Returns [(stream_key, message_id, fields), ...]."""
+    if not r or not stream_keys: return []
+    try:
+        response = await r.xreadgroup(OUTBOX_GROUP, consumer, {k: ">" for k in stream_keys}, count=count, block=block_ms)
+        return [(stream_key, message_id, fields)
+                for stream_key, entries in response or [] # type: ignore
+                for message_id, fields in entries]
+    except Exception as e:
+        print(f"Error reading the outbox: {e}")
+        return []
+
+async def outbox_claim_stale(stream_key: str, consumer: str, min_idle_ms: int, count: int):
+    """Takes over messages another consumer read but never acknowledged (it crashed, or lost the shard)."""
+    if not r: return []
+    try:
+        response = await auto.xautoclaim(stream_key, OUTBOX_GROUP, consumer, min_idle_ms, start_id="0-0", count=count)
+        return response[1] # type: ignore
+    except Exception as e:
+        print(f"Error claiming stale outbox messages: {e}")
+        return []
+
+# Resets a pending message's idle time, only if `consumer` still owns it.
+# KEYS: stream. ARGV: group, consumer, message ID.
+_OUTBOX_TOUCH_LUA = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[3], ARGV[3], 1)
+if #pending == 0 or pending[1][2] ~= ARGV[2] then
+    return 0
+end
+redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, ARGV[3], 'JUSTID')
+return 1
+"""
+_outbox_touch_script = r.register_script(_OUTBOX_TOUCH_LUA) if r else None
+
+async def outbox_touch(stream_key: str, consumer: str, message_id) -> bool:
+    """
+    Called right before sending: False if another consumer claimed the message while it
+    waited in our batch (it'd be sent twice). Otherwise its idle clock restarts.
+    """
+    if not r: return False
+    try:
+        return bool(await _outbox_touch_script(keys=[stream_key], args=[OUTBOX_GROUP, consumer, message_id]))
+    except Exception as e:
+        print(f"Error checking outbox message {message_id}: {e}")
+        return False
+
+async def outbox_ack(stream_key: str, message_id):
+    """Marks a message as delivered and removes it from the stream."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        pipe.xack(stream_key, OUTBOX_GROUP, message_id)
+        pipe.xdel(stream_key, message_id)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error acknowledging outbox message {message_id}: {e}")
+
+async def outbox_retry_later(stream_key: str, message_id, fields: dict, ready_at: float):
+    """Moves a failed message to the delayed set until `ready_at`."""
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        # The message ID keeps two identical messages (same chat, text, attempts) apart
+        member = json.dumps({"id": message_id, "fields": fields}, sort_keys=True)
+        pipe.zadd(OUTBOX_DELAYED_KEY, {member: ready_at})
+        pipe.xack(stream_key, OUTBOX_GROUP, message_id)
+        pipe.xdel(stream_key, message_id)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error scheduling retry for outbox message {message_id}: {e}")
+
+# Moves delayed messages back into their streams: the ZREM and the XADD happen together
+# (or not at all), and whoever removes a member owns it, so two workers never both re-queue it.
+# KEYS: delayed set. ARGV: maxlen, then member, stream key pairs.
+_OUTBOX_PROMOTE_LUA = """
+local promoted = 0
+for i = 2, #ARGV, 2 do
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        local entry = cjson.decode(ARGV[i])
+        local fields = entry['fields'] or entry
+        local args = {}
+        for k, v in pairs(fields) do
+            table.insert(args, k)
+            table.insert(args, tostring(v))
+        end
+        redis.call('XADD', ARGV[i + 1], 'MAXLEN', '~', ARGV[1], '*', unpack(args))
+        promoted = promoted + 1
+    end
+end
+return promoted
+"""
+_outbox_promote_script = r.register_script(_OUTBOX_PROMOTE_LUA) if r else None
+
+async def outbox_promote_due(now: float, stream_for, limit: int = 100) -> int:
+    """Puts delayed messages whose backoff is over back into their stream (`stream_for(fields)`)."""
+    if not r: return 0
+    try:
+        args = [OUTBOX_MAXLEN]
+        for member in await auto.zrangebyscore(OUTBOX_DELAYED_KEY, "-inf", now, start=0, num=limit): # type: ignore
+            entry = json.loads(member)
+            fields = entry.get("fields", entry)  # members saved before the ID was added are just the fields
+            args += [member, stream_for(fields)]
+        if len(args) == 1:
+            return 0
+        return int(await _outbox_promote_script(keys=[OUTBOX_DELAYED_KEY], args=args))
+    except Exception as e:
+        print(f"Error promoting delayed outbox messages: {e}")
+        return 0
+
+async def revive_chat(chat_id):
+    """Takes a chat off the dead chat set (it talked to us again, e.g. /start after unblocking)."""
+    if not r: return
+    try:
+        await auto.srem(DEAD_CHATS_KEY, str(chat_id))
+    except Exception as e:
+        print(f"Error reviving chat {chat_id} in Redis: {e}")
+
+async def outbox_dead_letter(stream_key: str, message_id, fields: dict, reason: str, dead_chat: bool):
+    """
+    Gives up on a message. If the chat itself is gone (blocked the bot, deleted),
+    it is also moved to the dead chat set and unsubscribed, so fan-out skips it.
+    """
+    if not r: return
+    try:
+        pipe = r.pipeline()
+        pipe.xadd(OUTBOX_DEAD_STREAM_KEY, {**fields, "reason": reason}, maxlen=10000, approximate=True)
+        if dead_chat:
+            pipe.sadd(DEAD_CHATS_KEY, fields["chat_id"])
+            pipe.srem(SUBSCRIBERS_KEY, fields["chat_id"])
+        pipe.xack(stream_key, OUTBOX_GROUP, message_id)
+        pipe.xdel(stream_key, message_id)
+        await pipe.execute()
+        if dead_chat:
+            await publish_invalidation(SUBSCRIBERS_KEY, fields["chat_id"])
+    except Exception as e:
+        print(f"Error dead-lettering outbox message {message_id}: {e}")
+
+
+# --- Cluster Functions (leader lock and worker membership) ---
+# KEYS: leader key. ARGV: worker_id, ttl_ms. Renews our lock or takes a free one.
+_LEADER_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+# Releases the lock only if we still hold it
+_RELEASE_LEADER_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_leader_script = r.register_script(_LEADER_LUA) if r else None
+_release_leader_script = r.register_script(_RELEASE_LEADER_LUA) if r else None
+
+async def leader_heartbeat(worker_id: str, ttl_ms: int) -> bool:
+    """Renews or acquires the leader lock. Without Redis, a single process is always the leader."""
+    if not r: return True
+    try:
+        return bool(await _leader_script(keys=[LEADER_KEY], args=[worker_id, ttl_ms]))
+    except Exception as e:
+        print(f"Error renewing leader lock: {e}")
+        return False
+
+async def workers_heartbeat(worker_id: str, ttl_seconds: float):
+    """Records that this worker is alive and returns every live worker."""
+    if not r: return [worker_id]
+    try:
+        now = time.time()
+        pipe = r.pipeline()
+        pipe.zadd(WORKERS_KEY, {worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - ttl_seconds)
+        pipe.zrange(WORKERS_KEY, 0, -1)
+        return (await pipe.execute())[-1]
+    except Exception as e:
+        print(f"Error updating worker membership: {e}")
+        return [worker_id]
+
+async def leave_cluster(worker_id: str):
+    if not r: return
+    try:
+        await _release_leader_script(keys=[LEADER_KEY], args=[worker_id])
+        await auto.zrem(WORKERS_KEY, worker_id)
+    except Exception as e:
+        print(f"Error leaving the cluster: {e}")
+
+
+# --- Local Caches (in-memory copies kept coherent between processes) ---
+class LocalCache:
+    """
+    Read-through in-memory cache of per-user values stored in Redis.
+
+    Every write to the underlying key publishes an invalidation (see
+    publish_invalidation); every process drops the entry when it hears it and
+    reloads it on the next read. `name` is the Redis key the values come from.
+    """
+
+    def __init__(self, name: str, load_one, load_many=None):
+        self.name = name
+        self._load_one = load_one      # async: key -> value
+        self._load_many = load_many    # async: [keys] -> {key: value}
+        self._data = {}
+        self._generation = 0           # bumped by every invalidation
+        self.hits = self.misses = self.invalidations = 0
+        _caches[name] = self
+
+    def _store(self, generation, values):
+        # Something was invalidated while we were loading: the values may be stale
+        if generation == self._generation:
+            self._data.update(values)
+
+    async def get(self, key, default=None):
+        key = str(key)
+        if key in self._data:
+            self.hits += 1
+            value = self._data[key]
+            return default if value is None else value
+
+        self.misses += 1
+        generation = self._generation
+        value = await self._load_one(key)
+        self._store(generation, {key: value})
+        return default if value is None else value
+
+    async def get_many(self, keys, default=None) -> dict:
+        """Like get() for many keys, loading all the misses in one go. Keys are returned as given."""
+        result, missing = {}, []
+        for key in keys:
+            if str(key) in self._data:
+                self.hits += 1
+                result[key] = self._data[str(key)]
+            else:
+                self.misses += 1
+                missing.append(key)
+
+        if missing:
+            generation = self._generation
+            if self._load_many:
+                loaded = await self._load_many([str(k) for k in missing])
+            else:
+                loaded = dict(zip(
+                    [str(k) for k in missing],
+                    await asyncio.gather(*(self._load_one(str(k)) for k in missing))
+                ))
+            loaded = {str(k): loaded.get(str(k)) for k in missing}
+            self._store(generation, loaded)
+            for key in missing:
+                result[key] = loaded[str(key)]
+
+        return {k: default if v is None else v for k, v in result.items()}
+
+    def invalidate(self, key=None):
+        """Drops one entry (or everything when key is None)."""
+        self._generation += 1
+        self.invalidations += 1
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(str(key), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data), "hits": self.hits, "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+_caches = {}  # name -> LocalCache
+_invalidation_listeners = {}  # name -> [callback(key or None)], see on_invalidation
+_listener = None
+_channel_handlers = {}  # extra pub/sub channel -> handler(message data), see subscribe_channel
+
+def _apply_invalidation(message: str):
+    name, _, key = message.partition("\t")
+    cache = _caches.get(name)
+    if cache:
+        cache.invalidate(key or None)
+    for callback in _invalidation_listeners.get(name, []):
+        callback(key or None)
+
+def on_invalidation(name: str, callback):
+    """Calls callback(key) (None: everything) whenever entries of `name` change in any process."""
+    _invalidation_listeners.setdefault(name, []).append(callback)
+
+async def publish_invalidation(name: str, key=None):
+    """Tells every process (this one right away) that `key` of `name` changed. No key: everything."""
+    message = name if key is None else f"{name}\t{key}"
+    _apply_invalidation(message)
+    if not r: return
+    try:
+        if name in (PREFS_KEY, SUBSCRIBERS_KEY):
+            if key is None:
+                await auto.delete(REGISTRY_SNAPSHOT_KEY) # the snapshot can't be patched up any more
+            else:
+                await auto.zadd(REGISTRY_DIRTY_KEY, {str(key): time.time()})
+        await auto.publish(CACHE_INVALIDATION_CHANNEL, message) # type: ignore
+    except Exception as e:
+        print(f"Error publishing cache invalidation for {name}: {e}")
+
+async def _listen_invalidations():
+    while True:
+        try:
+            async with r.pubsub(ignore_subscribe_messages=True) as pubsub: # type: ignore
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL, *_channel_handlers)
+                # We may have missed messages while (re)connecting: start from scratch
+                for cache in list(_caches.values()):
+                    cache.invalidate()
+                for callbacks in list(_invalidation_listeners.values()):
+                    for callback in callbacks:
+                        callback(None)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"] == CACHE_INVALIDATION_CHANNEL:
+                        _apply_invalidation(message["data"])
+                    else:
+                        try:
+                            _channel_handlers[message["channel"]](message["data"])
+                        except Exception as e:
+                            print(f"Error handling message on {message['channel']}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Cache invalidation listener lost Redis, reconnecting: {e}")
+            await asyncio.sleep(1)
+
+def subscribe_channel(channel: str, handler):
+    """Calls handler(data) for every message on `channel`. Register before start_cache_listener()."""
+    _channel_handlers[channel] = handler
+
+def start_cache_listener():
+    """
+    Starts (once) the background task that applies other processes' invalidations
+    (and dispatches the channels registered with subscribe_channel).
+    """
+    global _listener
+    if not r or _listener: return
+    _listener = asyncio.create_task(_listen_invalidations())
+
+def cache_stats() -> dict:
+    """Hit/miss counters of every local cache (and of auto-pipelining), by name."""
+    stats = {name: cache.stats() for name, cache in _caches.items()}
+    if auto:
+        stats["autopipeline"] = {"batches": auto.batches, "commands": auto.commands}
+    return stats
+
+
+async def aclose():
+    """Stops the invalidation listener and closes the connection pool."""
+    global _listener
+    if _listener:
+        _listener.cancel()
+        await asyncio.gather(_listener, return_exceptions=True)
+        _listener = None
+    if r:
+        await r.aclose()
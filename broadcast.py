@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+from ratelimit import TokenBucket
+
+# --- Broadcast settings ---
+# Telegram allows ~30 messages/second per bot; stay a little below it
+TELEGRAM_MESSAGES_PER_SECOND = float(os.environ.get("TELEGRAM_MESSAGES_PER_SECOND", 25))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", 3))
+# Seconds each Telegram request (connect, pool, write, read) may take
+BROADCAST_SEND_TIMEOUT = float(os.environ.get("BROADCAST_SEND_TIMEOUT", 5))
+# Longer RetryAfter waits aren't slept through: the message is handed back as 'throttled'
+BROADCAST_MAX_RETRY_AFTER = float(os.environ.get("BROADCAST_MAX_RETRY_AFTER", 10))
+
+
+class Broadcaster:
+    """
+    Sends messages through one global token bucket, honouring Telegram's
+    RetryAfter. The outbox workers (outbox.py) provide the concurrency.
+
+    `bot` only needs an async `send_message(chat_id=..., text=..., **kwargs)`,
+    so a local fake bot can be used to benchmark it (benchmarks/bench_broadcast.py).
+    """
+
+    def __init__(self, rate=TELEGRAM_MESSAGES_PER_SECOND, max_attempts=BROADCAST_MAX_ATTEMPTS,
+                 send_timeout=BROADCAST_SEND_TIMEOUT, max_retry_after=BROADCAST_MAX_RETRY_AFTER):
+        self.max_attempts = max_attempts
+        self.send_timeout = send_timeout
+        self.max_retry_after = max_retry_after
+        self._bucket = TokenBucket(rate, capacity=rate)
+        self._throttled_until = 0.0
+
+    @property
+    def max_send_seconds(self) -> float:
+        """Upper bound of one send_one call, rate limit wait aside (the outbox's claim windows must be longer)."""
+        per_attempt = 4 * self.send_timeout + max(self.max_retry_after, self.max_attempts)
+        return self.max_attempts * per_attempt
+
+    def throttle_remaining(self) -> float:
+        """Seconds until Telegram's last long RetryAfter is over."""
+        return max(0.0, self._throttled_until - time.monotonic())
+
+    def set_rate(self, rate: float):
+        """Changes the shared rate limit (e.g. when several workers split Telegram's limit)."""
+        self._bucket.rate = rate
+        self._bucket.capacity = rate
+
+    @staticmethod
+    def _retry_delay(err: RetryAfter) -> float:
+        delay = err.retry_after
+        if isinstance(delay, timedelta):
+            delay = delay.total_seconds()
+        return float(delay)
+
+    async def send_one(self, bot, chat_id, text, **kwargs) -> str:
+        """
+        Sends one message. Returns 'sent', 'blocked', 'rejected', 'failed' (worth
+        retrying later) or 'throttled' (retry after throttle_remaining()).
+        """
+        timeouts = dict(connect_timeout=self.send_timeout, pool_timeout=self.send_timeout,
+                        write_timeout=self.send_timeout, read_timeout=self.send_timeout)
+        for attempt in range(1, self.max_attempts + 1):
+            if self.throttle_remaining() > self.max_retry_after:
+                return "throttled"
+            await self._bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **timeouts, **kwargs)
+                return "sent"
+
+            except RetryAfter as e:
+                # Flood control: wait exactly as long as Telegram asks, unless that's too long to hold the message
+                delay = self._retry_delay(e)
+                if delay > self.max_retry_after:
+                    self._throttled_until = max(self._throttled_until, time.monotonic() + delay)
+                    print(f"Telegram asked to wait {delay:.0f}s; handing the message to {chat_id} back.")
+                    return "throttled"
+                await asyncio.sleep(delay)
+
+            except Forbidden as e:
+                print(f"Chat {chat_id} blocked the bot: {e}")
+                return "blocked"
+
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    print(f"Chat {chat_id} no longer exists: {e}")
+                    return "blocked"
+                # Retrying won't fix a bad request (e.g. broken Markdown)
+                print(f"Telegram rejected message to {chat_id}: {e}")
+                return "rejected"
+
+            except (TimedOut, NetworkError) as e:
+                if attempt == self.max_attempts:
+                    print(f"Failed to send message to {chat_id}: {e}")
+                    return "failed"
+                await asyncio.sleep(attempt)
+
+            except Exception as e:
+                print(f"Failed to send message to {chat_id}: {e}")
+                return "failed"
+
+        print(f"Gave up sending to {chat_id} after {self.max_attempts} attempts.")
+        return "failed"
+
+
+# One shared broadcaster per process, so all sends share the same rate limit
+broadcaster = Broadcaster()
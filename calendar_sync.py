@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+
+import bot_storage
+import contest_tags
+import gcal
+
+# Google recommends at most 50 calls per batch request
+BATCH_SIZE = 50
+
+
+def event_id(contest_id) -> str:
+    """Deterministic Calendar event ID (base32hex: a-v, 0-9) so re-runs upsert instead of duplicating."""
+    return f"cfcontest{contest_id}"
+
+
+def fingerprint(contest) -> str:
+    """What we compare to decide whether an already-synced event needs a patch."""
+    return f"{contest['startTimeSeconds']}:{contest['durationSeconds']}"
+
+
+def _times(contest, tz: str):
+    start_dt = datetime.fromtimestamp(contest['startTimeSeconds'], tz=timezone.utc)
+    end_dt = start_dt + timedelta(seconds=contest['durationSeconds'])
+    return (
+        {'dateTime': start_dt.isoformat(), 'timeZone': tz},
+        {'dateTime': end_dt.isoformat(), 'timeZone': tz},
+    )
+
+
+def event_body(contest, tz: str):
+    start, end = _times(contest, tz)
+    return {
+        'id': event_id(contest['id']),
+        'summary': contest['name'],
+        'description': f"https://codeforces.com/contests/{contest['id']}",
+        'start': start,
+        'end': end,
+    }
+
+
+def patch_body(contest, tz: str):
+    # Only what a reschedule changes; 'confirmed' also revives an event the user deleted
+    start, end = _times(contest, tz)
+    return {'summary': contest['name'], 'start': start, 'end': end, 'status': 'confirmed'}
+
+
+async def _run_batch(user_id, service, calls):
+    """
+    Executes [(contest, request), ...] in Google batch requests.
+    Returns ([contests that succeeded], [contests whose insert hit an existing ID]).
+    """
+    succeeded, conflicts = [], []
+
+    for i in range(0, len(calls), BATCH_SIZE):
+        chunk = calls[i:i + BATCH_SIZE]
+        by_request_id = {}
+
+        def callback(request_id, response, exception):
+            contest = by_request_id[request_id]
+            if exception is None:
+                succeeded.append(contest)
+            elif getattr(getattr(exception, "resp", None), "status", None) == 409:
+                conflicts.append(contest)
+            else:
+                print(f"Calendar sync failed for user {user_id}, contest {contest['id']}: {exception}")
+
+        batch = service.new_batch_http_request(callback=callback)
+        for n, (contest, request) in enumerate(chunk):
+            by_request_id[str(n)] = contest
+            batch.add(request, request_id=str(n))
+        await gcal.execute(user_id, batch)
+
+    return succeeded, conflicts
+
+
+async def sync_user(user_id: int, creds, contests, prefs_mask: int, tz: str):
+    """
+    Pushes every upcoming contest matching the user's prefs into their calendar.
+    New contests are inserted, rescheduled ones patched, unchanged ones skipped.
+    Returns {"added": n, "updated": n, "unchanged": n}.
+    """
+    synced = await bot_storage.get_synced_events(user_id)
+    matching = [c for c in contests if contest_tags.matches(prefs_mask, contest_tags.contest_mask(c))]
+
+    to_insert = [c for c in matching if str(c['id']) not in synced]
+    to_patch = [c for c in matching if str(c['id']) in synced and synced[str(c['id'])] != fingerprint(c)]
+    unchanged = len(matching) - len(to_insert) - len(to_patch)
+
+    if not to_insert and not to_patch:
+        return {"added": 0, "updated": 0, "unchanged": unchanged}
+
+    service = gcal.get_service(user_id, creds)
+    events = service.events()
+
+    inserted, conflicts = await _run_batch(user_id, service, [
+        (c, events.insert(calendarId='primary', body=event_body(c, tz))) for c in to_insert
+    ])
+
+    # An insert conflicts when the event already exists (e.g. added before, or deleted by the user):
+    # patch those together with the rescheduled ones
+    patched, _ = await _run_batch(user_id, service, [
+        (c, events.patch(calendarId='primary', eventId=event_id(c['id']), body=patch_body(c, tz)))
+        for c in to_patch + conflicts
+    ])
+
+    await bot_storage.save_synced_events(user_id, {str(c['id']): fingerprint(c) for c in inserted + patched})
+    return {"added": len(inserted), "updated": len(patched), "unchanged": unchanged}
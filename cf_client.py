@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import random
+import asyncio
+from contextlib import aclosing
+
+import httpx
+
+from ratelimit import TokenBucket
+
+# --- Codeforces API settings ---
+API_BASE_URL = "https://codeforces.com/api"
+USER_AGENT = "MyCodeforcesBot/1.0"
+
+# Codeforces allows one request every 2 seconds
+CF_REQUESTS_PER_SECOND = float(os.environ.get("CF_REQUESTS_PER_SECOND", 0.5))
+CF_MAX_RETRIES = int(os.environ.get("CF_MAX_RETRIES", 4))
+CF_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+# contest.list is newest first: stop reading after this many finished contests in a row
+CF_STREAM_STOP_AFTER = int(os.environ.get("CF_STREAM_STOP_AFTER", 5))
+
+_RESULT_START = re.compile(r'"result"\s*:\s*\[')
+_STATUS = re.compile(r'"status"\s*:\s*"(\w+)"')
+
+
+class CodeforcesAPIError(Exception):
+    """Codeforces answered, but not with status 'OK'."""
+
+
+class CodeforcesClient:
+    """
+    Async Codeforces API client.
+
+    Uses one long-lived pooled httpx.AsyncClient, a token bucket for the
+    API rate limit and jittered exponential backoff for transient errors.
+    """
+
+    def __init__(self, rate=CF_REQUESTS_PER_SECOND, max_retries=CF_MAX_RETRIES, timeout=CF_TIMEOUT):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._bucket = TokenBucket(rate, capacity=1)
+        self._client = None
+
+    def _get_client(self):
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=API_BASE_URL,
+                headers={"User-Agent": USER_AGENT},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # 1s, 2s, 4s, ... capped at 30s, with full jitter
+        return random.uniform(0, min(30.0, 2 ** attempt))
+
+    @staticmethod
+    def _is_retryable(err: Exception) -> bool:
+        if isinstance(err, httpx.HTTPStatusError):
+            return err.response.status_code == 429 or err.response.status_code >= 500
+        if isinstance(err, CodeforcesAPIError):
+            return "limit exceeded" in str(err).lower()
+        return isinstance(err, httpx.TransportError)
+
+    async def call(self, method: str, **params):
+        """Calls an API method (e.g. 'contest.list') and returns its 'result'."""
+        client = self._get_client()
+
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                response = await client.get(f"/{method}", params=params)
+                response.raise_for_status()
+                data = response.json()
+                if data.get("status") != "OK":
+                    raise CodeforcesAPIError(data.get("comment", "API reported an error, not 'OK'."))
+                return data["result"]
+
+            except Exception as err:
+                if attempt < self.max_retries and self._is_retryable(err):
+                    delay = self._backoff(attempt)
+                    print(f"Codeforces {method} failed ({err}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+
+    async def contest_list(self, gym: bool = False):
+        return await self.call("contest.list", gym=str(gym).lower())
+
+    async def stream(self, method: str, **params):
+        """
+        Calls an API method and yields the items of its 'result' array one by one
+        while the body is still downloading. Stop iterating to stop the download.
+        Retries only happen before the first item is yielded.
+        """
+        client = self._get_client()
+
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            yielded = False
+            try:
+                async with client.stream("GET", f"/{method}", params=params) as response:
+                    response.raise_for_status()
+                    async with aclosing(iter_json_array(response.aiter_text())) as items:
+                        async for item in items:
+                            yielded = True
+                            yield item
+                return
+
+            except Exception as err:
+                if not yielded and attempt < self.max_retries and self._is_retryable(err):
+                    delay = self._backoff(attempt)
+                    print(f"Codeforces {method} failed ({err}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+
+    def stream_contest_list(self, gym: bool = False):
+        return self.stream("contest.list", gym=str(gym).lower())
+
+
+async def iter_json_array(chunks):
+    """
+    Incrementally parses a Codeforces response body ({"status": ..., "result": [...]})
+    from an async iterator of text chunks, yielding each element of "result"
+    as soon as it has been fully received.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = None  # position inside buf once we are inside the result array
+    exhausted = False
+    chunks = chunks.__aiter__()
+
+    async def read_more():
+        nonlocal buf, exhausted
+        try:
+            buf += await chunks.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+
+    # 1. Find the start of the result array (and check the status on the way)
+    while pos is None:
+        match = _RESULT_START.search(buf)
+        if match:
+            status = _STATUS.search(buf, 0, match.start())
+            if status and status.group(1) != "OK":
+                raise CodeforcesAPIError(f"API reported status {status.group(1)}")
+            pos = match.end()
+            break
+        if exhausted:
+            # No result array: this is an error body like {"status":"FAILED","comment":...}
+            data = json.loads(buf)
+            raise CodeforcesAPIError(data.get("comment", "API reported an error, not 'OK'."))
+        await read_more()
+
+    # 2. Decode one element at a time
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == "]":
+            return
+
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element not fully downloaded yet (or the body is broken)
+                if exhausted:
+                    raise
+            else:
+                yield item
+                # Drop what we've consumed so the buffer stays small
+                buf = buf[end:]
+                pos = 0
+                continue
+
+        if exhausted:
+            raise ValueError("Response ended before the result array was closed.")
+        await read_more()
+
+
+# One shared client per process
+client = CodeforcesClient()
+
+
+async def fetch_upcoming_contests():
+    """
+    Returns every upcoming contest, soonest first, or None on any error.
+
+    contest.list is ordered newest first, so the upcoming contests are at the
+    head of the array. The body is parsed while it streams in and the download
+    is dropped once we are well past the BEFORE/CODING block.
+    """
+    contests = []
+    finished_in_a_row = 0
+    try:
+        async with aclosing(client.stream_contest_list(gym=False)) as stream:
+            async for c in stream:
+                if c["phase"] == "FINISHED":
+                    finished_in_a_row += 1
+                    if finished_in_a_row >= CF_STREAM_STOP_AFTER:
+                        break
+                else:
+                    finished_in_a_row = 0
+                contests.append(c)
+
+    except httpx.HTTPStatusError as http_err:
+        if http_err.response.status_code == 400:
+            print("Error 400: Bad Request. Check your API parameters.")
+            print(f"Details: {http_err.response.text}")
+        else:
+            print(f"An HTTP error occurred: {http_err}")
+        return None
+
+    except ValueError:
+        print("Failed to decode the response as JSON.")
+        return None
+
+    except Exception as err:
+        print(f"A non-HTTP error occurred: {err}")
+        return None
+
+    upcoming_contests = [c for c in contests if c["phase"] == "BEFORE"]
+    return sorted(upcoming_contests, key=lambda x: x['startTimeSeconds'])
@@ -0,0 +1,86 @@
+import os
+import time
+import socket
+import asyncio
+import hashlib
+
+import bot_storage
+
+# --- Cluster settings ---
+# Number of fixed virtual shards the subscribers are split into.
+# Changing it re-routes chats, so only change it with empty outboxes.
+NUM_SHARDS = int(os.environ.get("BOT_SHARDS", 16))
+LEADER_TTL_MS = int(os.environ.get("BOT_LEADER_TTL_MS", 15000))
+HEARTBEAT_SECONDS = LEADER_TTL_MS / 3000
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_of(chat_id) -> int:
+    """Deterministic shard of a chat."""
+    return int(chat_id) % NUM_SHARDS
+
+
+def owner_of(shard: int, workers) -> str:
+    """Rendezvous hashing: only the shards of a worker that joins/leaves move."""
+    return max(workers, key=lambda w: hashlib.md5(f"{w}:{shard}".encode()).digest())
+
+
+class Cluster:
+    """
+    Tracks this worker's place among all bot workers sharing one Telegram token.
+
+    - Leadership: a Redis lock with a TTL, renewed on every heartbeat.
+      Only the leader runs the scheduling jobs.
+    - Membership: every worker heartbeats into a sorted set; the live workers
+      split the shards between them with rendezvous hashing.
+    - `on_change(cluster, became_leader)` is called whenever leadership or owned shards change.
+    """
+
+    def __init__(self, worker_id=WORKER_ID, on_change=None):
+        self.worker_id = worker_id
+        self.on_change = on_change
+        self.is_leader = False
+        self.workers = [worker_id]
+        self.shards = set(range(NUM_SHARDS))
+        self._task = None
+
+    def _rebalance(self, workers):
+        workers = sorted(workers) or [self.worker_id]
+        shards = {s for s in range(NUM_SHARDS) if owner_of(s, workers) == self.worker_id}
+        changed = workers != self.workers or shards != self.shards
+        self.workers, self.shards = workers, shards
+        return changed
+
+    async def tick(self):
+        """One heartbeat: renew/acquire leadership and refresh membership."""
+        was_leader = self.is_leader
+        self.is_leader = await bot_storage.leader_heartbeat(self.worker_id, LEADER_TTL_MS)
+        live = await bot_storage.workers_heartbeat(self.worker_id, LEADER_TTL_MS / 1000)
+        changed = self._rebalance(live) or was_leader != self.is_leader
+
+        if changed:
+            print(f"[cluster] {self.worker_id}: leader={self.is_leader}, "
+                  f"{len(self.workers)} worker(s), shards={sorted(self.shards)}")
+            if self.on_change:
+                self.on_change(self, self.is_leader and not was_leader)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"[cluster] heartbeat failed: {e}")
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def start(self):
+        await self.tick()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # Leave right away so the others take over our shards without waiting for the TTL
+        await bot_storage.leave_cluster(self.worker_id)
+        self.is_leader = False
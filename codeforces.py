@@ -1,88 +1,186 @@
 from telegram.ext import Application
-import requests
-from requests.exceptions import HTTPError
 import datetime
 from dotenv import load_dotenv
 from telegram import Bot, Update
 from telegram.ext import CommandHandler, Updater, CallbackContext, ApplicationBuilder , ContextTypes, CallbackQueryHandler
 from typing import List, Dict
 import json, os
+import time
 import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import httpx
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from datetime import datetime, timedelta
 import shlex
 import secrets
 from telegram import BotCommand
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import bot_storage
+import cf_client
+from contest_cache import ContestCache
+import outbox
+from cluster import Cluster
+from broadcast import broadcaster, TELEGRAM_MESSAGES_PER_SECOND
+import contest_tags
+import contest_view
+import auth_client
+import gcal
+import calendar_sync
+from reminder_scheduler import ReminderScheduler, format_offset
+import custom_reminders
+from subscriber_registry import SubscriberRegistry
+from auth_client import get_creds_for_user
 
 
 load_dotenv()
 
-Internal_API_KEY = os.getenv("INTERNAL_API_KEY")
-
 FASTAPI_SERVER_URL = os.getenv("FASTAPI_SERVER_URL")
 
+# How many outbox messages are queued (and checkpointed) per transaction
+OUTBOX_BATCH_SIZE = 500
+# Broadcasts left running (lost leadership, Redis errors) are picked up this often
+LEDGER_RESUME_INTERVAL = 300
+# A reminder whose recipients couldn't be loaded is retried after this long
+REMINDER_RETRY_DELAY = 30
 
-# Load all data from our new storage file
-user_prefs = bot_storage.load_prefs()
-subscribed_users = bot_storage.load_set_from_file(bot_storage.SUBSCRIBERS_KEY)
-reminded_contests = bot_storage.load_set_from_file(bot_storage.REMINDED_KEY)
+# This worker's view of the other bot workers (leader + shards), started in post_init
+bot_cluster = Cluster()
 
 
-def get_upcoming_contests():
+def _prefs_mask(prefs_list) -> int:
+    return contest_tags.parse_prefs(prefs_list)[0]
 
-    API_URL = "https://codeforces.com/api/contest.list"
-    params = {'gym': 'false'}
-    
-    # This header identifies your script. This is the fix.
-    headers = {
-        'User-Agent': 'MyCodeforcesBot/1.0'
-    }
 
-    try:
-        response = requests.get(API_URL, params=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+async def _load_prefs_mask(user_id):
+    return _prefs_mask(await bot_storage.get_user_prefs(user_id))
 
-        if data.get("status") != "OK":
-            print("API reported an error, not 'OK'.")
-            return None  # <-- FIX 1: Return None, not a string
 
-        contests = data["result"]
-        
-        # Use a list comprehension (square brackets) to create the list directly
-        upcoming_contests = [c for c in contests if c["phase"] == "BEFORE"]
-        
-        contests_sorted = sorted(upcoming_contests, key=lambda x: x['startTimeSeconds'])
-        return contests_sorted[:10] # Success! Return the list
+async def _load_prefs_masks(user_ids):
+    return {str(u): _prefs_mask(p) for u, p in (await bot_storage.get_prefs_bulk(user_ids)).items()}
 
-    except HTTPError as http_err:
-        if http_err.response.status_code == 400:
-            print(f"Error 400: Bad Request. Check your API parameters.")
-            try:
-                print(f"Details: {http_err.response.json()}")
-            except requests.exceptions.JSONDecodeError:
-                print(f"Details: {http_err.response.text}")
+
+# Local read-through copies of the Redis data, invalidated over pub/sub
+# whenever any process writes (see bot_storage.LocalCache)
+# user_prefs maps user_id -> preference bitmask (see contest_tags)
+user_prefs = bot_storage.LocalCache(bot_storage.PREFS_KEY, load_one=_load_prefs_mask, load_many=_load_prefs_masks)
+
+# --- Subscriber registry: every subscriber and their prefs mask, in compact arrays ---
+# Loaded from a snapshot in Redis plus the changes since, then kept up to date
+# through the same invalidations as the caches above.
+REGISTRY_CLOCK_MARGIN = 60  # seconds, for clock differences between processes
+subscribers = SubscriberRegistry()
+_registry_synced_at = 0.0
+_registry_tasks = set()
+
+
+async def _refresh_subscribers(user_ids):
+    """Re-reads the subscription and prefs of some users into the registry."""
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return
+    subscribed = await asyncio.gather(
+        *(bot_storage.is_in_set_file(u, bot_storage.SUBSCRIBERS_KEY) for u in user_ids)
+    )
+    prefs = await bot_storage.get_prefs_bulk(user_ids)
+    for user_id, is_subscribed in zip(user_ids, subscribed):
+        if is_subscribed:
+            subscribers.set(user_id, _prefs_mask(prefs.get(user_id, [])))
         else:
-            print(f"An HTTP error occurred: {http_err}")
-            
-    except requests.exceptions.JSONDecodeError:
-        print("Failed to decode the response as JSON.")
-        
-    except Exception as err:
-        print(f"A non-HTTP error occurred: {err}")
-        
-    return None  # <-- FIX 2: Return None on ANY exception
+            subscribers.discard(user_id)
+
+
+async def _catch_up_subscribers(since: float):
+    global _registry_synced_at
+    now = time.time()
+    await _refresh_subscribers(await bot_storage.registry_changed_since(since - REGISTRY_CLOCK_MARGIN))
+    _registry_synced_at = now
+
+
+def _on_subscriber_change(user_id):
+    # user_id None: we may have missed changes (e.g. pub/sub reconnected)
+    if user_id is None:
+        task = asyncio.create_task(_catch_up_subscribers(_registry_synced_at))
+    else:
+        task = asyncio.create_task(_refresh_subscribers([user_id]))
+    _registry_tasks.add(task)
+    task.add_done_callback(_registry_tasks.discard)
+
+
+bot_storage.on_invalidation(bot_storage.SUBSCRIBERS_KEY, _on_subscriber_change)
+bot_storage.on_invalidation(bot_storage.PREFS_KEY, _on_subscriber_change)
+
+
+async def load_subscribers():
+    """Loads the registry from its snapshot (or scans Redis if there is no usable one)."""
+    global subscribers
+    started = time.time()
+    registry, since = None, started
+
+    snapshot = await bot_storage.load_registry_snapshot()
+    if snapshot and started - snapshot[0] < bot_storage.REGISTRY_DIRTY_KEEP - REGISTRY_CLOCK_MARGIN:
+        try:
+            registry = await asyncio.to_thread(SubscriberRegistry.from_text, snapshot[1])
+            since = snapshot[0]
+        except ValueError as e:
+            print(f"Ignoring subscriber registry snapshot: {e}")
+
+    if registry is None:
+        pairs = []
+        async for batch in bot_storage.scan_subscribers_with_prefs():
+            pairs.extend((user_id, _prefs_mask(prefs)) for user_id, prefs in batch)
+        registry = SubscriberRegistry.from_pairs(pairs)
+        await bot_storage.save_registry_snapshot(await asyncio.to_thread(registry.to_text), started)
+
+    subscribers = registry
+    await _catch_up_subscribers(since)
+    print(f"Loaded {len(subscribers)} subscribers ({subscribers.nbytes} bytes) in {time.time() - started:.2f}s")
+
+
+async def save_subscriber_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    """Leader only: refreshes the registry snapshot so other processes start fast."""
+    if not bot_cluster.is_leader:
+        return
+    saved_at = time.time()
+    # Copy first: the arrays keep changing on the event loop while the thread compresses
+    data = await asyncio.to_thread(subscribers.copy().to_text)
+    await bot_storage.save_registry_snapshot(data, saved_at)
+
+
+async def ensure_prefs_index():
+    """Builds the tag -> users index once for data saved before the index existed."""
+    if not await bot_storage.prefs_index_exists():
+        prefs_dict, subscribed = {}, []
+        async for batch in bot_storage.scan_prefs():
+            prefs_dict.update((user_id, contest_tags.labels(_prefs_mask(prefs))) for user_id, prefs in batch.items())
+        async for batch in bot_storage.scan_set(bot_storage.SUBSCRIBERS_KEY):
+            subscribed.extend(batch)
+        await bot_storage.rebuild_prefs_index(prefs_dict, subscribed)
+
+
+async def fetch_upcoming_contests():
+    """Returns every upcoming contest, soonest first, or None on failure."""
+    contests = await cf_client.fetch_upcoming_contests()
+    if contests is None:
+        return None
+
+    # Classify each contest once, when the cache is filled
+    for c in contests:
+        c["tags"] = contest_tags.classify(c["name"])
+    return contests
+
+
+# One cache per process, backed by the shared Redis snapshot.
+contest_cache = ContestCache(fetch_upcoming_contests)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     users_id  = update.effective_user.id # type: ignore
-    subscribed_users.add(users_id)
-    bot_storage.add_to_set_file(users_id, bot_storage.SUBSCRIBERS_KEY)
+    if users_id not in subscribers:
+        # A chat dead-lettered earlier (blocked the bot) is reachable again
+        await bot_storage.revive_chat(users_id)
+        mask = await user_prefs.get(users_id, 0)
+        await bot_storage.add_to_set_file(users_id, bot_storage.SUBSCRIBERS_KEY)
+        prefs = contest_tags.labels(mask)
+        await bot_storage.update_prefs_index(users_id, prefs, prefs)
+        subscribers.set(users_id, mask)
     
     # --- FIX: Changed command names to match your handlers ---
     welcome_text = (
@@ -113,64 +211,48 @@ async def setprefs(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please Provide at least any preference (e.g., Div.2, Div.3).")  # type: ignore
         return
     
+    mask, unknown = contest_tags.parse_prefs(prefs)
+    if unknown or not mask:
+        await update.message.reply_text( # type: ignore
+            f"Sorry, I don't recognise: {', '.join(unknown) or ' '.join(prefs)}\n"
+            f"Valid preferences: {', '.join(contest_tags.LABELS.values())}"
+        )
+        return
     
-    user_prefs[user_id] = prefs # type: ignore
-    bot_storage.save_prefs(user_prefs)
+    # Write-through: only this user's field (and index entries) change in Redis
+    await bot_storage.set_user_prefs(user_id, contest_tags.labels(mask))
 
-    await update.message.reply_text(f"Preferences Saved! You will now recieve contest for Divisions: {', '.join(prefs)}") # type: ignore
+    # Users with their own lead times aren't in the shared reminder jobs: plan their
+    # timers for contests the new prefs let in (already planned ones are no-ops)
+    settings = await bot_storage.get_reminder_settings(user_id)
+    if settings:
+        await _plan_user_timers(user_id, settings, mask)
+
+    await update.message.reply_text(f"Preferences Saved! You will now recieve contest for Divisions: {', '.join(contest_tags.labels(mask))}") # type: ignore
 
 
 async def nextcontest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id # type: ignore
-    contests = get_upcoming_contests()
+    snapshot = await contest_cache.get_snapshot()
 
     # --- THIS IS THE SAFETY CHECK ---
-    # If the API call failed, 'contests' will be None.
+    # If the API call failed, 'snapshot' will be None.
     # This 'if' block stops the function and prevents the crash.
-    if contests is None:
+    if snapshot is None:
         await update.message.reply_text("Sorry, I couldn't fetch the contest data. Please try again later.") # type: ignore
         return  # Stop the function
     # --------------------------------
 
-    prefs = user_prefs.get(user_id, []) # type: ignore
-
-    if prefs:
-        contests = [c for c in contests if any(div in c["name"] for div in prefs)] # type: ignore
+    prefs_mask = await user_prefs.get(user_id, 0) # type: ignore
 
-    if not contests:
+    # One message with one button row per contest, rendered once per contest list and prefs
+    rendered = contest_view.render_upcoming(snapshot, prefs_mask)
+    if not rendered:
         await update.message.reply_text("No upcoming contests found according to your preferences.") # type: ignore
         return
-    
-    
-    # --- FIX 1: Send the header ONCE, before the loop ---
-    await update.message.reply_text("🏁 Upcoming Contests:") # type: ignore
-    
-    # --- THIS IS THE LOOP ---
-    # It just builds the 'msg' string
-    for c in contests:
-        #FIX 2: Build the message from scratch ---
-        start_time = datetime.fromtimestamp(c['startTimeSeconds']).strftime("%a, %d %b %Y at %I:%M %p") # type: ignore
-        msg = (
-            f"• *{c['name']}*\n"
-            f"  🕒 Start Time: {start_time}\n"
-            f"  Duration: {c['durationSeconds']//3600} hrs\n"
-            f"  🔗 Link: https://codeforces.com/contests/{c['id']}"
-        )
-
-        button = InlineKeyboardButton(
-            text="Add to Google Calender",
-            callback_data=f"add_{c['id']}" 
-        )
-
-        #keyboard creation
-        keyboard = InlineKeyboardMarkup(
-            [[button]]
-        )
-        
-        await update.message.reply_text(msg,reply_markup=keyboard,parse_mode="Markdown") #type: ignore
-    
-    # --- END OF THE LOOP ---
 
+    text, keyboard = rendered
+    await update.message.reply_text(text, reply_markup=keyboard, parse_mode="Markdown", disable_web_page_preview=True) #type: ignore
 
 
 async def handle_to_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -182,27 +264,23 @@ async def handle_to_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = query.from_user.id # type: ignore
         print(f"Callback triggered: {data} from {user_id}")
 
-        if not data.startswith("add_"): # type: ignore
+        parsed = contest_view.parse_callback(data or "")
+        if not parsed or parsed[0] != contest_view.ACTION_ADD:
             return
 
-        contest_id = data.split("_")[1] # type: ignore
         creds = await get_creds_for_user(user_id)
         if not creds:
             await query.message.reply_text("Please authenticate with /connectauth first.") # type: ignore
             return
 
-        contests = get_upcoming_contests()
-        if not contests:
-            await query.message.reply_text("Couldn’t fetch contests.") # type: ignore
-            return
-
-        contest_to_add = next((c for c in contests if str(c["id"]) == contest_id), None)
+        # O(1) lookup in the contest index: no Codeforces call, and not limited to the top 10
+        contest_to_add = await contest_cache.by_id(parsed[1])
         if not contest_to_add:
             await query.message.reply_text("Contest not found.") # type: ignore
             return
 
         summary = contest_to_add["name"]
-        tz = await get_user_timezone(user_id)
+        tz = await get_user_timezone(user_id, creds)
         start_dt = datetime.fromtimestamp(contest_to_add['startTimeSeconds'])
         end_dt = start_dt + timedelta(seconds=contest_to_add['durationSeconds'])
 
@@ -212,19 +290,19 @@ async def handle_to_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'end': {'dateTime': end_dt.isoformat(), 'timeZone': tz},
         }
 
-        service = build('calendar', 'v3', credentials=creds)
-
-        def insert_event():
-            return service.events().insert(calendarId='primary', body=event_body).execute()
+        service = gcal.get_service(user_id, creds)
 
         print("Inserting event...")
-        await asyncio.to_thread(insert_event)
+        await gcal.execute(user_id, service.events().insert(calendarId='primary', body=event_body))
         print("✅ Event added!")
 
-        await query.edit_message_text(f"✅ Event '{summary}' added to your calendar!") # type: ignore
+        # Reply instead of editing: the message lists the other contests too
+        await query.message.reply_text(f"✅ Event '{summary}' added to your calendar!") # type: ignore
 
     except Exception as e:
         print(f" ERROR in handle_to_button: {e}")
+        if auth_client.is_auth_error(e):
+            auth_client.invalidate_creds(query.from_user.id) # type: ignore
         import traceback
         traceback.print_exc()
         await query.message.reply_text("⚠️ Something went wrong.") # type: ignore
@@ -238,41 +316,211 @@ async def handle_to_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 #Setting the Reminder Scheduler
-async def send_reminders(context: ContextTypes.DEFAULT_TYPE):
-    bot = context.bot
-    contests = get_upcoming_contests()
+async def deliver_broadcast(ledger_id, recipients, text, resume=False):
+    """
+    Queues `text` for every recipient in the outbox, through the delivery ledger:
+    the recipients are recorded first and every queued batch is checkpointed in
+    the same transaction, so a restarted worker resumes exactly where the
+    previous one stopped. With `resume=True` an existing running ledger is
+    continued (its recipients and text are used); otherwise an existing ledger
+    means someone else owns this broadcast. The outbox workers do the sending.
+
+    Returns False only if nothing could be recorded (Redis failed before the
+    ledger existed), so the caller should try again later. Once the ledger
+    exists, a failure leaves it running and resume_deliveries finishes it.
+    """
+    if ledger_id in _active_broadcasts:
+        return True  # this process is queueing it right now
+
+    ledger = await bot_storage.ledger_load(ledger_id)
+    if ledger and (ledger["status"] == "done" or not resume):
+        return True
+
+    if ledger is None:
+        if resume:
+            return True
+        recipients = sorted(recipients)
+        started = await bot_storage.ledger_begin(ledger_id, recipients, text)
+        if started is None:
+            return False
+        if not started:
+            return True  # another worker just started it
+        done = set()
+    else:
+        recipients, text, done = ledger["recipients"], ledger["text"], ledger["done"]
+        print(f"Resuming broadcast {ledger_id}: {len(done)}/{len(recipients)} already queued")
+
+    pending = [u for u in recipients if u not in done]
+    _active_broadcasts.add(ledger_id)
+    try:
+        for i in range(0, len(pending), OUTBOX_BATCH_SIZE):
+            if not bot_cluster.is_leader:
+                # Leave the ledger running: the new leader resumes it
+                print(f"Lost leadership during broadcast {ledger_id}, stopping.")
+                return True
+            if not await outbox.enqueue(pending[i:i + OUTBOX_BATCH_SIZE], text, parse_mode="Markdown", ledger_id=ledger_id):
+                # Leave the ledger running: the unqueued chats aren't in its done set
+                print(f"Couldn't queue broadcast {ledger_id}, leaving it for resume_deliveries.")
+                return True
+    finally:
+        _active_broadcasts.discard(ledger_id)
+
+    await bot_storage.ledger_finish(ledger_id)
+    print(f"Broadcast {ledger_id} queued for {len(pending)} chats.")
+    return True
+
+
+# Ledgers this process is queueing at the moment (so resume_deliveries leaves them alone)
+_active_broadcasts = set()
+
+
+async def resume_deliveries(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Runs when this worker becomes leader, and then every LEDGER_RESUME_INTERVAL:
+    finishes broadcasts that a previous leader (or a failed attempt) didn't.
+    """
+    if not bot_cluster.is_leader:
+        return
+
+    running = list(await bot_storage.load_set_from_file(bot_storage.LEDGER_RUNNING_KEY))
+    statuses = await bot_storage.ledger_status_many(running)
+
+    await bot_storage.ledger_forget_running([l for l in running if statuses.get(l) is None])
+    for ledger_id in running:
+        if statuses.get(ledger_id) == "running":
+            await deliver_broadcast(ledger_id, [], "", resume=True)
+
+
+async def send_contest_reminder(context: ContextTypes.DEFAULT_TYPE):
+    """Runs at exactly `offset` seconds before a contest (one job per contest and offset)."""
+    if not bot_cluster.is_leader:
+        return
+
+    data = context.job.data # type: ignore
+    contest_id, offset = data["contest_id"], data["offset"]
+
+    contests = await contest_cache.get()
+    c = next((c for c in contests or [] if c["id"] == contest_id), None)
+
+    # Skip if the contest vanished or moved since this job was scheduled
+    # (the next refresh schedules the new time)
+    if c is None or c["startTimeSeconds"] != data["start"]:
+        print(f"Skipping reminder for {contest_id}: contest changed.")
+        return
+
+    # The start time is part of the ID: a postponed contest gets its reminders again
+    ledger_id = f"{contest_id}:{offset}:{data['start']}"
+    if await bot_storage.ledger_status(ledger_id):
+        return  # already sent, or being resumed
+
+    # Only the index sets of this contest's tags, in one SUNION in Redis.
+    # Users with their own lead times get theirs from the timing wheel instead.
+    matching_tags = contest_tags.labels(contest_tags.contest_mask(c))
+    recipients = await bot_storage.get_subscribers_for_tags(matching_tags, not_in=bot_storage.CUSTOM_REMINDER_USERS_KEY)
+
+    recorded = recipients is not None and await deliver_broadcast(
+        ledger_id,
+        recipients,
+        f"⏰ Reminder: *{c['name']}* starts in {format_offset(offset)}!\nJoin here: https://codeforces.com/contests",
+    )
+    if not recorded and time.time() + REMINDER_RETRY_DELAY < data["start"]:
+        # Nothing recorded under this ID yet, so a retry can still send it
+        print(f"Reminder {ledger_id} failed, retrying in {REMINDER_RETRY_DELAY}s.")
+        context.job_queue.run_once(send_contest_reminder, when=REMINDER_RETRY_DELAY, data=data) # type: ignore
+
+
+reminder_scheduler = ReminderScheduler(send_contest_reminder)
+
+
+async def refresh_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Re-syncs the reminder jobs with the (cached) contest list. Leader only."""
+    if not bot_cluster.is_leader:
+        return
+
+    contests = await contest_cache.get()
 
-    # Safety check: Stop if the API call failed
+    # Safety check: keep the existing jobs if the API call failed
     if contests is None:
-        print("send_reminders: Failed to fetch contests, skipping run.")
+        print("refresh_reminders: Failed to fetch contests, skipping run.")
         return
-    
-    now = datetime.now().timestamp() # type: ignore
 
-    for c in contests: # type: ignore
-        start_time = c["startTimeSeconds"]
-        Time_left = start_time - now
-        
-        
-        
-        if 0 < Time_left <= 1800 and not bot_storage.is_in_set_file(c["id"], bot_storage.REMINDED_KEY): #30 minutes before the contest
-            for user_id in subscribed_users:
-                prefs = user_prefs.get(user_id, []) # type: ignore
+    changed = reminder_scheduler.sync(context.job_queue, contests)
+    if changed:
+        print(f"Reminder jobs rebuilt for {changed} contest(s).")
 
-                if prefs  and not any(div in c["name"] for div in prefs):
-                    continue
+    # Plan per-user timers, but only for contests that are new or moved since the last plan
+    # (the plan is kept in Redis, so a restart doesn't redo it)
+    planned = await bot_storage.get_planned_starts()
+    now = time.time()
+    newly_planned = {}
+    for c in contests:
+        if planned.get(c["id"]) == c["startTimeSeconds"]:
+            continue
+        matching_tags = contest_tags.labels(contest_tags.contest_mask(c))
+        users = await bot_storage.get_subscribers_for_tags(matching_tags, only_in=bot_storage.CUSTOM_REMINDER_USERS_KEY)
+        if users is None:
+            continue  # not marked as planned: the next refresh tries again
+        settings = await bot_storage.get_reminder_settings_bulk(users)
+        await bot_storage.wheel_add(custom_reminders.plan_timers(c, settings, now))
+        newly_planned[c["id"]] = c["startTimeSeconds"]
+
+    current_ids = {c["id"] for c in contests}
+    await bot_storage.set_planned_starts(newly_planned, removed=[cid for cid in planned if cid not in current_ids])
+
+
+async def deliver_custom_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Runs every minute: sends the per-user reminders whose timing-wheel slot is due. Leader only."""
+    if not bot_cluster.is_leader:
+        return
+
+    now = time.time()
+    # Timers are only removed from the wheel once their broadcasts are recorded
+    # in the delivery ledger, so a crash in between re-reads them next minute
+    timers = await bot_storage.wheel_due(now)
+    if not timers:
+        return
 
-                try:
-                    await bot.send_message(
-                        chat_id = user_id,
-                        text=f"⏰ Reminder: *{c['name']}* starts in 30 minutes!\nJoin here: https://codeforces.com/contests",
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    print(f"Failed to send Reminde to {user_id}: {e}")
+    contests = await contest_cache.get()
+    if contests is None:
+        print("deliver_custom_reminders: Failed to fetch contests, retrying next minute.")
+        return
+    contests = {c["id"]: c for c in contests}
+    decoded = [(*custom_reminders.decode_timer(member), fire_at) for member, fire_at in timers]
+    user_ids = {t[0] for t in decoded}
+    settings = await bot_storage.get_reminder_settings_bulk(user_ids)
+    timezones = await bot_storage.get_cached_timezones(user_ids)
+    masks = await user_prefs.get_many(user_ids, 0)
+
+    # (contest_id, offset, start, slot) -> users, so each distinct message is one broadcast
+    # (and a retry after a crash gets the same ledger ID)
+    groups = {}
+    for user_id, contest_id, offset, start, fire_at in decoded:
+        c = contests.get(contest_id)
+        user_settings = settings.get(user_id)
+        if c is None or c["startTimeSeconds"] != start or start <= now:
+            continue  # contest moved, vanished or already started
+        if user_settings is None or offset not in custom_reminders.offsets_for(user_settings):
+            continue  # user changed their lead times since this timer was planned
+        if not contest_tags.matches(masks[user_id], contest_tags.contest_mask(c)):
+            continue  # user changed their prefs
+        if custom_reminders.in_quiet_hours(user_settings.get("quiet"), timezones.get(user_id), now):
+            continue
+        slot = fire_at // bot_storage.WHEEL_RESOLUTION
+        groups.setdefault((contest_id, offset, start, slot), []).append(user_id)
+
+    for (contest_id, offset, start, slot), recipients in groups.items():
+        c = contests[contest_id]
+        recorded = await deliver_broadcast(
+            f"custom:{contest_id}:{offset}:{start}:{slot}",
+            recipients,
+            f"⏰ Reminder: *{c['name']}* starts in {format_offset(offset)}!\nJoin here: https://codeforces.com/contests",
+        )
+        if not recorded:
+            return  # keep the timers: next minute retries (recorded groups are skipped by their ledger)
+        if not bot_cluster.is_leader:
+            return  # the new leader picks up the remaining timers
 
-            # --- FIX 4 (SPAM): Add contest to the set so we don't send again ---
-            bot_storage.add_to_set_file(c['id'], bot_storage.REMINDED_KEY)
+    await bot_storage.wheel_ack(timers)
 
 
 async def connectgoogle_auth(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -297,60 +545,23 @@ async def connectgoogle_auth(update: Update, context: ContextTypes.DEFAULT_TYPE)
         disable_web_page_preview=True
     )
 
-async def get_creds_for_user(user_id: int):
-
-    headers = {"X-API-KEY": Internal_API_KEY}
-    Params = {"user_id": user_id}
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{FASTAPI_SERVER_URL}/get_user_tokens", headers=headers, params=Params ,timeout=10.0) # type: ignore
-            response.raise_for_status()
-
-            token_data = response.json()
-            return Credentials(**token_data)
-        
-        except httpx.HTTPStatusError as http_err:
-            # This catches 4xx and 5xx errors
-            if http_err.response.status_code == 404:
-                print(f"Token not found for user {user_id}")
-            else:
-                print(f"HTTP error from token server: {http_err}")
-            return None
-            
-        except httpx.RequestError as e:
-            # This catches network errors (connection, timeout, etc.)
-            print(f"Failed to connect to token server: {e}")
-            return None
-        except Exception as e:
-            # Catch any other unexpected errors
-            print(f"An unknown error occurred: {e}")
-            return None
-        
-
 #setting the timezone of the user
-async def get_user_timezone(user_id: int):
-    creds = await get_creds_for_user(user_id)
+async def get_user_timezone(user_id: int, creds=None):
+    # Callers that already have the creds pass them in, to skip a token-server request
+    if creds is None:
+        creds = await get_creds_for_user(user_id)
 
     if not creds:
         print(f"No creds for user {user_id}, defaulting to UTC.")
         return "UTC"
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        # 3. Define the slow, blocking code you want to run
-        def get_calendar_from_google():
-            # This .execute() call is what freezes your bot
-            return service.calendars().get(calendarId='primary').execute()
-        # 4. Run the blocking code in a separate thread
-        # This is the key fix. The 'await' pauses this function,
-        # but the rest of your bot keeps running.
-        calendar_data = await asyncio.to_thread(get_calendar_from_google)
-
-        time_zone = calendar_data.get('timeZone', 'UTC')
-        return time_zone
+        # Cached in Redis; Google is only asked on a miss (in a thread)
+        return await gcal.get_timezone(user_id, creds)
     
     except Exception as e:
         print(f"Error getting timezone for {user_id}: {e}")
+        if auth_client.is_auth_error(e):
+            auth_client.invalidate_creds(user_id)
         return "UTC"  # Always default to UTC on any error
         
 # Command to add event to Google Calendar
@@ -396,7 +607,7 @@ async def add_event_to_calendar(update: Update, context: ContextTypes.DEFAULT_TY
 
     # 5. Build the Google Calendar event
     try:
-        timeZone_user = await get_user_timezone(user_id)
+        timeZone_user = await get_user_timezone(user_id, creds)
         # Try to parse the time string to make sure it's valid
         # We assume a 1-hour duration for this example
         start_dt = datetime.fromisoformat(start_time_str) # type: ignore
@@ -425,30 +636,281 @@ async def add_event_to_calendar(update: Update, context: ContextTypes.DEFAULT_TY
     
     # 6. Insert the event
     try:
-        # Build the Google Calendar service
-        service = build('calendar', 'v3', credentials=creds)
-        
-        # Define the blocking function
-        def insert_event_to_google():
-            return service.events().insert(calendarId='primary', body=event_body).execute()
+        # Reuse the user's Google Calendar service
+        service = gcal.get_service(user_id, creds)
 
-        # Run it with asyncio.to_thread to prevent freezing
-        await asyncio.to_thread(insert_event_to_google)
+        # Runs in a thread to prevent freezing
+        await gcal.execute(user_id, service.events().insert(calendarId='primary', body=event_body))
         
         await update.message.reply_text(f"✅ Event '{summary}' added to your calendar!") # type: ignore
         
         
     except Exception as e:
         print(f"Failed to add event for {user_id}: {e}")
+        if auth_client.is_auth_error(e):
+            auth_client.invalidate_creds(user_id)
         # This could fail if the token expired.
         await update.message.reply_text("❌ Sorry, I couldn't add the event. Please try to /auth again.") # type: ignore
 
 
+async def _save_reminder_settings(user_id, settings):
+    """Saves a user's reminder settings and plans their timers for the known contests."""
+    await bot_storage.set_reminder_settings(user_id, settings)
+    if not settings:
+        return  # back on the shared default reminders
+    await _plan_user_timers(user_id, settings, await user_prefs.get(user_id, 0))
+
+
+async def _plan_user_timers(user_id, settings, prefs_mask):
+    """Adds one user's timers for the known contests to the wheel."""
+    contests = await contest_cache.get()
+    if contests:
+        await bot_storage.wheel_add(custom_reminders.plan_user_timers(
+            user_id, settings, contests, prefs_mask, time.time()
+        ))
+
+
+# Command to choose your own reminder lead times
+async def remindme(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id  # type: ignore
+    settings = await bot_storage.get_reminder_settings(user_id) or {}
+
+    if not context.args:
+        current = ", ".join(format_offset(o) for o in custom_reminders.offsets_for(settings))
+        await update.message.reply_text(  # type: ignore
+            f"Your reminders: {current} before each contest.\n\n"
+            "Usage:\n/remindme 1d 2h 15m\n/remindme default"
+        )
+        return
+
+    if context.args[0].lower() == "default":
+        settings.pop("offsets", None)
+    else:
+        try:
+            settings["offsets"] = custom_reminders.parse_offsets(context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"{e}\nExample: /remindme 1d 2h 15m")  # type: ignore
+            return
+
+    await _save_reminder_settings(user_id, settings)
+    current = ", ".join(format_offset(o) for o in custom_reminders.offsets_for(settings))
+    await update.message.reply_text(f"✅ You will be reminded {current} before each contest.")  # type: ignore
+
+
+# Command to mute reminders during some hours of the day
+async def quiet(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id  # type: ignore
+    settings = await bot_storage.get_reminder_settings(user_id) or {}
+
+    if not context.args:
+        await update.message.reply_text(  # type: ignore
+            "Usage:\n/quiet 23-7  (no reminders from 23:00 to 07:00, in your calendar's timezone or UTC)\n/quiet off"
+        )
+        return
+
+    if context.args[0].lower() == "off":
+        settings.pop("quiet", None)
+        reply = "✅ Quiet hours turned off."
+    else:
+        try:
+            settings["quiet"] = custom_reminders.parse_quiet_hours("".join(context.args))
+        except ValueError as e:
+            await update.message.reply_text(f"{e}\nExample: /quiet 23-7")  # type: ignore
+            return
+        reply = f"✅ No reminders between {settings['quiet'][0]}:00 and {settings['quiet'][1]}:00."
+
+    await _save_reminder_settings(user_id, settings)
+    await update.message.reply_text(reply)  # type: ignore
+
+
+# Command to get a message as soon as a matching contest is announced or moved
+async def announce(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id  # type: ignore
+
+    if not context.args:
+        current = await bot_storage.get_announce_tags(user_id)
+        status = ("off" if current is None else ", ".join(current) or "all contests")
+        await update.message.reply_text(  # type: ignore
+            f"New contest announcements: {status}\n\n"
+            "Usage:\n/announce Div.2 Div.3\n/announce all\n/announce off"
+        )
+        return
+
+    choice = context.args[0].lower()
+    if choice == "off":
+        await bot_storage.set_announce_tags(user_id, None)
+        await update.message.reply_text("✅ Announcements turned off.")  # type: ignore
+        return
+
+    if choice == "all":
+        tags = []
+    else:
+        mask, unknown = contest_tags.parse_prefs(context.args)
+        if unknown or not mask:
+            await update.message.reply_text(  # type: ignore
+                f"Sorry, I don't recognise: {', '.join(unknown) or ' '.join(context.args)}\n"
+                f"Valid preferences: {', '.join(contest_tags.LABELS.values())}"
+            )
+            return
+        tags = contest_tags.labels(mask)
+
+    await bot_storage.set_announce_tags(user_id, tags)
+    await update.message.reply_text(  # type: ignore
+        f"✅ I'll tell you as soon as {', '.join(tags) or 'any'} contests are announced or rescheduled."
+    )
+
+
+# Command to push every matching upcoming contest into Google Calendar
+async def syncall(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id  # type: ignore
+
+    if context.args and context.args[0].lower() == "off":
+        await bot_storage.remove_from_set_file(user_id, bot_storage.CALENDAR_SYNC_USERS_KEY)
+        await update.message.reply_text("Automatic calendar sync turned off.")  # type: ignore
+        return
+
+    creds = await get_creds_for_user(user_id)
+    if not creds:
+        await update.message.reply_text("Please authenticate your Google Account /connectauth to use this feature.")  # type: ignore
+        return
+
+    contests = await contest_cache.get()
+    if contests is None:
+        await update.message.reply_text("Sorry, I couldn't fetch the contest data. Please try again later.")  # type: ignore
+        return
+
+    try:
+        tz = await get_user_timezone(user_id, creds)
+        stats = await calendar_sync.sync_user(user_id, creds, contests, await user_prefs.get(user_id, 0), tz)
+    except Exception as e:
+        print(f"Calendar sync failed for {user_id}: {e}")
+        if auth_client.is_auth_error(e):
+            auth_client.invalidate_creds(user_id)
+        await update.message.reply_text("❌ Sorry, I couldn't sync your calendar. Please try to /connectauth again.")  # type: ignore
+        return
+
+    # From now on the background job keeps this user's calendar up to date
+    await bot_storage.add_to_set_file(user_id, bot_storage.CALENDAR_SYNC_USERS_KEY)
+
+    await update.message.reply_text(  # type: ignore
+        f"✅ Calendar synced: {stats['added']} added, {stats['updated']} updated, {stats['unchanged']} already there.\n"
+        "New and rescheduled contests will be synced automatically (/syncall off to stop)."
+    )
+
+
+# Background job: keep opted-in calendars in sync
+async def sync_calendars(context: ContextTypes.DEFAULT_TYPE):
+    if not bot_cluster.is_leader:
+        return
+
+    contests = await contest_cache.get()
+    if contests is None:
+        print("sync_calendars: Failed to fetch contests, skipping run.")
+        return
+
+    # A batch of opted-in users at a time, so the run doesn't hold every user's creds at once
+    async for batch in bot_storage.scan_set(bot_storage.CALENDAR_SYNC_USERS_KEY, batch=500):
+        all_creds = await auth_client.get_creds_for_users([int(u) for u in batch])
+        masks = await user_prefs.get_many(all_creds, 0)
+
+        for user_id, creds in all_creds.items():
+            try:
+                tz = await gcal.get_timezone(user_id, creds)
+                stats = await calendar_sync.sync_user(user_id, creds, contests, masks[user_id], tz)
+                if stats["added"] or stats["updated"]:
+                    print(f"Calendar sync for {user_id}: {stats}")
+            except Exception as e:
+                print(f"Calendar sync failed for {user_id}: {e}")
+                if auth_client.is_auth_error(e):
+                    auth_client.invalidate_creds(user_id)
+
+
+async def handle_contest_changes(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Runs on the leader whenever a new contest list version is published:
+    re-plans the reminders right away and pushes announcements to opted-in users.
+    """
+    if not bot_cluster.is_leader:
+        return
+
+    data = context.job.data # type: ignore
+    changes = data["changes"]
+    print(f"Contest list v{data['version']} changed, reacting.")
+    await refresh_reminders(context)
+
+    announcements = []
+    for c in changes["added"]:
+        start = datetime.fromtimestamp(c['startTimeSeconds']).strftime("%a, %d %b %Y at %I:%M %p")
+        announcements.append((c, f"announce:{c['id']}",
+                              f"📣 New contest announced: *{c['name']}*\n🕒 {start}\nhttps://codeforces.com/contests/{c['id']}"))
+    for item in changes["rescheduled"]:
+        c = item["contest"]
+        start = datetime.fromtimestamp(c['startTimeSeconds']).strftime("%a, %d %b %Y at %I:%M %p")
+        announcements.append((c, f"rescheduled:{c['id']}:{c['startTimeSeconds']}",
+                              f"🔁 *{c['name']}* was rescheduled: it now starts {start}."))
+
+    for c, ledger_id, text in announcements:
+        recipients = await bot_storage.get_announce_subscribers(contest_tags.labels(contest_tags.contest_mask(c)))
+        if recipients is None:
+            print(f"Skipping announcement {ledger_id}: couldn't load its recipients.")
+        elif recipients:
+            await deliver_broadcast(ledger_id, recipients, text)
+
+
+async def log_cache_stats(context: ContextTypes.DEFAULT_TYPE):
+    print(f"Local cache stats: {bot_storage.cache_stats()}")
+    print(f"Subscriber registry: {len(subscribers)} users, {subscribers.nbytes} bytes")
+
+
 async def post_init(application: Application):
     """
     This function runs *after* the bot is initialized
     but *before* polling starts.
+    Logs how long each startup step took, so slow deploys show up in the logs.
     """
+    started = step_started = time.perf_counter()
+    timings = []
+
+    def step_done(name):
+        nonlocal step_started
+        now = time.perf_counter()
+        timings.append(f"{name} {now - step_started:.2f}s")
+        step_started = now
+
+    await bot_storage.check_connection()
+    step_done("redis")
+
+    # Hear about prefs/subscriber changes and new contest lists from every process
+    def on_contest_changes(data):
+        message = json.loads(data)
+        contest_cache.mark_outdated(message["version"])
+        if bot_cluster.is_leader:
+            application.job_queue.run_once(handle_contest_changes, when=0, data=message) # type: ignore
+
+    bot_storage.subscribe_channel(bot_storage.CONTEST_CHANGES_CHANNEL, on_contest_changes)
+    bot_storage.start_cache_listener()
+    await ensure_prefs_index()
+    step_done("prefs index")
+    await load_subscribers()
+    step_done("subscribers")
+
+    # Start the workers that deliver everything queued in the outbox
+    pool = application.bot_data["outbox"] = outbox.OutboxWorkerPool(application.bot)
+
+    def on_cluster_change(cluster, became_leader):
+        # Deliver only our own shards, and share Telegram's rate limit with the other workers
+        pool.set_shards(cluster.shards)
+        broadcaster.set_rate(TELEGRAM_MESSAGES_PER_SECOND / len(cluster.workers))
+        if became_leader:
+            application.job_queue.run_once(resume_deliveries, when=0) # type: ignore
+            application.job_queue.run_once(refresh_reminders, when=0) # type: ignore
+
+    bot_cluster.on_change = on_cluster_change
+    await bot_cluster.start()
+    pool.set_shards(bot_cluster.shards)
+    await pool.start()
+    step_done("cluster and outbox")
+
     print("Setting bot commands...")
     commands = [
         BotCommand("start", "Subscribe to notifications"),
@@ -456,6 +918,10 @@ async def post_init(application: Application):
         BotCommand("setprefs", "Set your preferred divisions"),
         BotCommand("connectauth", "Connect your Google Calendar"),
         BotCommand("addevent", "Manually add an event"),
+        BotCommand("syncall", "Add all matching contests to your calendar"),
+        BotCommand("remindme", "Choose when you get reminded"),
+        BotCommand("quiet", "Set quiet hours for reminders"),
+        BotCommand("announce", "Get told when new contests are announced"),
     ]
     
     try:
@@ -463,24 +929,60 @@ async def post_init(application: Application):
         print("Bot commands set successfully.")
     except Exception as e:
         print(f"Failed to set bot commands: {e}")
+    step_done("commands")
 
+    print(f"Startup took {time.perf_counter() - started:.2f}s ({', '.join(timings)})")
 
 
+async def post_shutdown(application: Application):
+    """Stops the outbox workers and closes the pooled HTTP clients when the bot stops."""
+    if "outbox" in application.bot_data:
+        await application.bot_data["outbox"].stop()
+    await bot_cluster.stop()
+    await bot_storage.aclose()
+    await cf_client.client.aclose()
+    await auth_client.aclose()
 
 
 
-def main():
-    # 1. Make sure "TELEGRAM_TOKEN" matches your .env file
+
+
+
+async def start_application(application: Application):
+    """Starts the jobs, outbox workers and update processing, without polling."""
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+
+
+async def stop_application(application: Application):
+    await application.stop()
+    await post_shutdown(application)
+    await application.shutdown()
+
+
+async def run_without_polling(application: Application):
+    """Runs an Application that doesn't poll (updates come from a webhook, or not at all)."""
+    await start_application(application)
+    try:
+        await asyncio.Event().wait()  # until the process is stopped
+    finally:
+        await stop_application(application)
+
+
+def build_application(concurrent_updates=False) -> Application:
+    """Builds the Application with every handler and background job (used by polling and webhook mode)."""
     TOKEN = os.getenv("TELEGRAM_TOKEN")
     if not TOKEN:
-        print("Error: TELEGRAM_TOKEN not found in environment variables!")
-        return
+        raise RuntimeError("TELEGRAM_TOKEN not found in environment variables!")
 
     # 2. Removed the extra dot "..post_init"
     application = (
         ApplicationBuilder()
         .token(TOKEN)
+        .concurrent_updates(concurrent_updates)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     ) # type: ignore
 
@@ -494,11 +996,39 @@ def main():
 
     application.add_handler(CommandHandler("connectauth", connectgoogle_auth))
     application.add_handler(CommandHandler("addevent", add_event_to_calendar))
+    application.add_handler(CommandHandler("syncall", syncall))
+    application.add_handler(CommandHandler("remindme", remindme))
+    application.add_handler(CommandHandler("quiet", quiet))
+    application.add_handler(CommandHandler("announce", announce))
     application.add_handler(CallbackQueryHandler(handle_to_button))
     
     # --- SCHEDULE THE JOB ---
     job_queue = application.job_queue
-    job_queue.run_repeating(send_reminders, interval=900) # type: ignore
+    job_queue.run_repeating(refresh_reminders, interval=contest_cache.ttl, first=0) # type: ignore
+    job_queue.run_repeating(deliver_custom_reminders, interval=bot_storage.WHEEL_RESOLUTION) # type: ignore
+    job_queue.run_repeating(sync_calendars, interval=3600, first=60) # type: ignore
+    job_queue.run_repeating(log_cache_stats, interval=3600, first=3600) # type: ignore
+    job_queue.run_repeating(resume_deliveries, interval=LEDGER_RESUME_INTERVAL, first=LEDGER_RESUME_INTERVAL) # type: ignore
+    job_queue.run_repeating(save_subscriber_snapshot, interval=3600, first=3600) # type: ignore
+
+    return application
+
+
+def main():
+    # 1. Make sure "TELEGRAM_TOKEN" matches your .env file
+    try:
+        application = build_application()
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return
+
+    # Only one process may poll Telegram per token: extra workers run with
+    # BOT_POLLING=0 and just take part in scheduling and delivery.
+    # (In webhook mode, updates arrive through server.py instead and every bot process uses BOT_POLLING=0)
+    if os.getenv("BOT_POLLING", "1") == "0":
+        print("CF Bot worker is Running (no polling)...")
+        asyncio.run(run_without_polling(application))
+        return
 
     print("CF Bot is Running with the reminders...")
     application.run_polling() # type: ignore
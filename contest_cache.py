@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+
+import bot_storage
+import contest_diff
+
+# --- Cache settings ---
+# How long a fetched contest list is served without asking Codeforces again
+CONTEST_CACHE_TTL = int(os.environ.get("CONTEST_CACHE_TTL", 300))
+# How long past the TTL we still serve the old list while refreshing in the background
+CONTEST_CACHE_STALE_TTL = int(os.environ.get("CONTEST_CACHE_STALE_TTL", 3600))
+# Contests stay findable by ID for this long after they end
+CONTEST_INDEX_KEEP = int(os.environ.get("CONTEST_INDEX_KEEP", 7 * 24 * 3600))
+
+
+class ContestCache:
+    """
+    Shared contest list cache.
+
+    - Fresh snapshots (younger than `ttl`) are returned straight away.
+    - Stale snapshots (younger than `ttl + stale_ttl`) are returned straight away
+      and a background refresh is started (stale-while-revalidate).
+    - Concurrent callers share a single in-flight fetch (single-flight).
+    - Every successful fetch is written to Redis so other bot processes reuse it.
+    - Every fetch is diffed against the previous snapshot: when something
+      changed, the snapshot gets a new version (shared counter in Redis) and
+      the changes are published on CONTEST_CHANGES_CHANNEL.
+    - Every contest seen is also indexed by ID (in memory and in Redis) until
+      CONTEST_INDEX_KEEP after it ends, see by_id().
+    """
+
+    def __init__(self, fetcher, ttl=CONTEST_CACHE_TTL, stale_ttl=CONTEST_CACHE_STALE_TTL):
+        # fetcher is an async callable returning the contest list, or None on failure
+        self._fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._snapshot = None  # {"version": ..., "fetched_at": ..., "contests": [...]}
+        self._inflight = None  # asyncio.Task of the running refresh, if any
+        self._by_id = {}       # contest_id -> contest, upcoming and recent
+        self._indexed_version = None
+        self._outdated = False  # another process published a newer snapshot
+
+    def _age(self, snapshot):
+        return time.time() - snapshot["fetched_at"]
+
+    def _index(self, snapshot):
+        """Merges a snapshot's contests into the in-memory index (once per version)."""
+        if snapshot["version"] == self._indexed_version:
+            return
+        keep_after = time.time() - CONTEST_INDEX_KEEP
+        self._by_id = {cid: c for cid, c in self._by_id.items()
+                       if c["startTimeSeconds"] + c["durationSeconds"] > keep_after}
+        self._by_id.update((c["id"], c) for c in snapshot["contests"])
+        self._indexed_version = snapshot["version"]
+
+    async def by_id(self, contest_id):
+        """Finds a known contest (upcoming or recently ended) by ID, without calling Codeforces."""
+        contest_id = int(contest_id)
+        if contest_id not in self._by_id and self._snapshot:
+            self._index(self._snapshot)
+        contest = self._by_id.get(contest_id)
+        if contest is None:
+            # Seen by another process, or before a restart
+            contest = await bot_storage.contest_index_get(contest_id)
+            if contest:
+                self._by_id[contest_id] = contest
+        return contest
+
+    def mark_outdated(self, version: int):
+        """Called when another process published snapshot `version`: reload it on the next get."""
+        if not self._snapshot or version > self._snapshot["version"]:
+            self._outdated = True
+
+    async def _load_shared(self):
+        """Picks up a newer snapshot written to Redis by another process."""
+        self._outdated = False
+        shared = await bot_storage.load_contest_snapshot()
+        if shared and (not self._snapshot or shared["fetched_at"] > self._snapshot["fetched_at"]):
+            self._snapshot = shared
+
+    async def _refresh(self):
+        contests = await self._fetcher()
+        if contests is None:
+            return None
+
+        now = time.time()
+        previous = self._snapshot or await bot_storage.load_contest_snapshot()
+        changes = None
+        if previous is None:
+            version = await bot_storage.next_contest_version()
+        else:
+            changes = contest_diff.diff(previous["contests"], contests, now)
+            # Contests that started also change the list (not worth publishing)
+            same_ids = [c["id"] for c in previous["contests"]] == [c["id"] for c in contests]
+            if contest_diff.is_empty(changes) and same_ids:
+                version, changes = previous["version"], None
+            else:
+                version = await bot_storage.next_contest_version()
+
+        snapshot = {"version": version, "fetched_at": now, "contests": contests}
+        self._snapshot = snapshot
+        await bot_storage.save_contest_snapshot(snapshot, self.ttl + self.stale_ttl)
+        self._index(snapshot)
+        await bot_storage.contest_index_put(contests, now - CONTEST_INDEX_KEEP)
+        if changes and not contest_diff.is_empty(changes):
+            print(f"Contest list v{version}: {contest_diff.summary(changes)}")
+            await bot_storage.publish_contest_changes(version, changes)
+        return snapshot
+
+    def _start_refresh(self):
+        """Starts a refresh unless one is already running, and returns its task."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._refresh())
+            self._inflight.add_done_callback(self._log_failure)
+        return self._inflight
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception():
+            print(f"Contest cache refresh failed: {task.exception()}")
+
+    async def get_snapshot(self):
+        """Returns the current snapshot dict, or None if nothing could be fetched."""
+        if not self._snapshot or self._outdated or self._age(self._snapshot) >= self.ttl:
+            await self._load_shared()
+
+        snapshot = self._snapshot
+        if snapshot:
+            age = self._age(snapshot)
+            if age < self.ttl:
+                return snapshot
+            if age < self.ttl + self.stale_ttl:
+                self._start_refresh()
+                return snapshot
+
+        # Nothing usable: wait for the (shared) refresh
+        try:
+            fresh = await asyncio.shield(self._start_refresh())
+        except Exception:
+            fresh = None
+        return fresh or snapshot
+
+    async def get(self):
+        """Returns the cached list of upcoming contests, or None."""
+        snapshot = await self.get_snapshot()
+        return snapshot["contests"] if snapshot else None
@@ -0,0 +1,43 @@
+import time
+
+
+def diff(old_contests, new_contests, now=None):
+    """
+    Compares two contest lists (by contest ID). Returns
+    {"added": [contest, ...], "removed": [contest, ...],
+     "rescheduled": [{"contest": new, "old_start": ...}, ...],
+     "duration_changed": [{"contest": new, "old_duration": ...}, ...],
+     "renamed": [{"contest": new, "old_name": ...}, ...]}.
+
+    Contests that simply started (and so left the upcoming list) aren't "removed".
+    """
+    now = time.time() if now is None else now
+    old = {c["id"]: c for c in old_contests}
+    new = {c["id"]: c for c in new_contests}
+
+    changes = {"added": [], "removed": [], "rescheduled": [], "duration_changed": [], "renamed": []}
+    for contest_id, c in new.items():
+        before = old.get(contest_id)
+        if before is None:
+            changes["added"].append(c)
+            continue
+        if before["startTimeSeconds"] != c["startTimeSeconds"]:
+            changes["rescheduled"].append({"contest": c, "old_start": before["startTimeSeconds"]})
+        if before["durationSeconds"] != c["durationSeconds"]:
+            changes["duration_changed"].append({"contest": c, "old_duration": before["durationSeconds"]})
+        if before["name"] != c["name"]:
+            changes["renamed"].append({"contest": c, "old_name": before["name"]})
+
+    for contest_id, c in old.items():
+        if contest_id not in new and c["startTimeSeconds"] > now:
+            changes["removed"].append(c)
+    return changes
+
+
+def is_empty(changes) -> bool:
+    return not any(changes.values())
+
+
+def summary(changes) -> str:
+    """'2 added, 1 rescheduled' (for logs)."""
+    return ", ".join(f"{len(v)} {k.replace('_', ' ')}" for k, v in changes.items() if v) or "no changes"
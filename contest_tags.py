@@ -0,0 +1,105 @@
+import re
+
+# --- Contest tags as bit flags ---
+# Every contest name is parsed once into a bitmask of these,
+# and user preferences are normalized into the same bitmask,
+# so a preference match is a single integer AND.
+DIV1 = 1 << 0
+DIV2 = 1 << 1
+DIV3 = 1 << 2
+DIV4 = 1 << 3
+EDUCATIONAL = 1 << 4
+GLOBAL = 1 << 5
+COMBINED = 1 << 6      # "Div. 1 + Div. 2" rounds
+KOTLIN = 1 << 7        # Kotlin Heroes
+APRIL_FOOLS = 1 << 8
+OTHER = 1 << 9         # anything we can't classify
+
+# Canonical label for every tag (what we show users and store in Redis)
+LABELS = {
+    DIV1: "Div.1",
+    DIV2: "Div.2",
+    DIV3: "Div.3",
+    DIV4: "Div.4",
+    EDUCATIONAL: "Educational",
+    GLOBAL: "Global",
+    COMBINED: "Div.1+2",
+    KOTLIN: "Kotlin",
+    APRIL_FOOLS: "AprilFools",
+    OTHER: "Other",
+}
+_BY_LABEL = {label.lower(): bit for bit, label in LABELS.items()}
+
+_DIV_RE = re.compile(r"div(?:ision)?\.?\s*([1-4])", re.IGNORECASE)
+_COMBINED_RE = re.compile(r"\bcombined\b|div\.?\s*1\s*\+\s*2\b", re.IGNORECASE)
+_KEYWORDS = [
+    (re.compile(r"\beducational\b|\bedu\b", re.IGNORECASE), EDUCATIONAL),
+    (re.compile(r"\bglobal\b", re.IGNORECASE), GLOBAL),
+    (re.compile(r"\bkotlin\b", re.IGNORECASE), KOTLIN),
+    (re.compile(r"\bapril\b|\bfools\b", re.IGNORECASE), APRIL_FOOLS),
+]
+_DIV_BITS = {"1": DIV1, "2": DIV2, "3": DIV3, "4": DIV4}
+
+
+def classify(name: str) -> int:
+    """Parses a contest name into its tag bitmask."""
+    mask = 0
+    divs = {_DIV_BITS[d] for d in _DIV_RE.findall(name)}
+    for bit in divs:
+        mask |= bit
+    if (len(divs) > 1 and "+" in name) or _COMBINED_RE.search(name):
+        mask |= COMBINED
+
+    for pattern, bit in _KEYWORDS:
+        if pattern.search(name):
+            mask |= bit
+
+    return mask or OTHER
+
+
+def parse_prefs(tokens):
+    """
+    Normalizes user input (e.g. ["Div.", "2", "edu"] or legacy stored prefs)
+    into a bitmask. Returns (mask, unknown_tokens).
+    """
+    text = " ".join(tokens)
+
+    mask = 0
+    if _COMBINED_RE.search(text):
+        mask |= COMBINED
+        text = _COMBINED_RE.sub(" ", text)
+
+    for d in _DIV_RE.findall(text):
+        mask |= _DIV_BITS[d]
+    rest = _DIV_RE.sub(" ", text)
+
+    for pattern, bit in _KEYWORDS:
+        if pattern.search(rest):
+            mask |= bit
+            rest = pattern.sub(" ", rest)
+
+    unknown = []
+    for word in rest.replace(",", " ").split():
+        bit = _BY_LABEL.get(word.lower())
+        if bit:
+            mask |= bit
+        elif word not in ("+", "and", "."):
+            unknown.append(word)
+    return mask, unknown
+
+
+def labels(mask: int):
+    """Returns the canonical labels of every tag set in `mask`."""
+    return [label for bit, label in LABELS.items() if mask & bit]
+
+
+def matches(prefs_mask: int, contest_mask: int) -> bool:
+    """No preference means 'everything'; otherwise any shared tag is a match."""
+    return not prefs_mask or bool(prefs_mask & contest_mask)
+
+
+def contest_mask(contest) -> int:
+    """Returns the tag mask of a contest dict, classifying it if needed."""
+    if "tags" not in contest:
+        contest["tags"] = classify(contest["name"])
+    return contest["tags"]
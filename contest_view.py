@@ -0,0 +1,76 @@
+import os
+from datetime import datetime
+
+from cachetools import LRUCache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import contest_tags
+
+# --- Settings ---
+NEXTCONTEST_LIMIT = 10
+# One entry per (snapshot version, prefs mask): a handful of distinct prefs cover almost everyone
+RENDER_CACHE_SIZE = int(os.environ.get("NEXTCONTEST_CACHE_SIZE", 256))
+BUTTON_NAME_LENGTH = 40
+
+# (snapshot version, prefs mask) -> (text, keyboard) or None when nothing matches
+_rendered = LRUCache(maxsize=RENDER_CACHE_SIZE)
+
+# --- Callback payloads: "<version>:<action>:<contest_id>" ---
+# Versioned so the format can change while old buttons are still around.
+# Buttons sent before the versioned format carry "add_<contest_id>".
+CALLBACK_VERSION = "c1"
+ACTION_ADD = "a"
+
+
+def callback_data(action: str, contest_id) -> str:
+    return f"{CALLBACK_VERSION}:{action}:{contest_id}"
+
+
+def parse_callback(data: str):
+    """Returns (action, contest_id) of a button payload, or None if it isn't one of ours."""
+    if data.startswith("add_") and data[4:].isdigit():
+        return ACTION_ADD, int(data[4:])
+    parts = data.split(":")
+    if len(parts) == 3 and parts[0] == CALLBACK_VERSION and parts[2].isdigit():
+        return parts[1], int(parts[2])
+    return None
+
+
+def _button_label(name: str) -> str:
+    if len(name) > BUTTON_NAME_LENGTH:
+        name = name[:BUTTON_NAME_LENGTH - 1] + "…"
+    return f"📅 Add: {name}"
+
+
+def _render(contests):
+    lines = ["🏁 *Upcoming Contests:*"]
+    rows = []
+    for c in contests:
+        start_time = datetime.fromtimestamp(c['startTimeSeconds']).strftime("%a, %d %b %Y at %I:%M %p")
+        lines.append(
+            f"\n• *{c['name']}*\n"
+            f"  🕒 Start Time: {start_time}\n"
+            f"  Duration: {c['durationSeconds']//3600} hrs\n"
+            f"  🔗 Link: https://codeforces.com/contests/{c['id']}"
+        )
+        rows.append([InlineKeyboardButton(text=_button_label(c['name']), callback_data=callback_data(ACTION_ADD, c['id']))])
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+
+def render_upcoming(snapshot, prefs_mask: int):
+    """
+    Returns (text, keyboard) listing the next contests of `snapshot` that match
+    `prefs_mask` (0 = everything), or None if none match. Rendered once per
+    snapshot version and prefs mask.
+    """
+    key = (snapshot["version"], prefs_mask)
+    if key in _rendered:
+        return _rendered[key]
+
+    contests = snapshot["contests"][:NEXTCONTEST_LIMIT]
+    if prefs_mask:
+        contests = [c for c in contests if contest_tags.matches(prefs_mask, contest_tags.contest_mask(c))]
+
+    rendered = _render(contests) if contests else None
+    _rendered[key] = rendered
+    return rendered
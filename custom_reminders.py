@@ -0,0 +1,96 @@
+import re
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import contest_tags
+from reminder_scheduler import REMINDER_OFFSETS
+
+# --- Limits for user-chosen reminders ---
+MAX_OFFSETS = 5
+MAX_OFFSET_SECONDS = 7 * 24 * 3600
+
+_OFFSET_RE = re.compile(r"(\d+)\s*([dhm])", re.IGNORECASE)
+_UNIT_SECONDS = {"d": 86400, "h": 3600, "m": 60}
+
+
+def parse_offset(text: str) -> int:
+    """'1d', '2h', '1h30m', '45m' -> seconds. Raises ValueError on anything else."""
+    text = text.strip().lower()
+    parts = _OFFSET_RE.findall(text)
+    if not parts or _OFFSET_RE.sub("", text).strip():
+        raise ValueError(f"Invalid lead time: {text}")
+
+    seconds = sum(int(amount) * _UNIT_SECONDS[unit] for amount, unit in parts)
+    if not 60 <= seconds <= MAX_OFFSET_SECONDS:
+        raise ValueError(f"Lead time must be between 1m and 7d: {text}")
+    return seconds
+
+
+def parse_offsets(args):
+    offsets = sorted({parse_offset(a) for a in args}, reverse=True)
+    if len(offsets) > MAX_OFFSETS:
+        raise ValueError(f"At most {MAX_OFFSETS} lead times, please.")
+    return offsets
+
+
+def parse_quiet_hours(text: str):
+    """'23-7' -> [23, 7] (quiet from 23:00 to 07:00). Raises ValueError otherwise."""
+    match = re.fullmatch(r"\s*(\d{1,2})\s*-\s*(\d{1,2})\s*", text)
+    if not match:
+        raise ValueError(f"Invalid quiet hours: {text}")
+    start, end = int(match.group(1)), int(match.group(2))
+    if not (0 <= start < 24 and 0 <= end < 24) or start == end:
+        raise ValueError(f"Invalid quiet hours: {text}")
+    return [start, end]
+
+
+def in_quiet_hours(quiet, tz_name, now: float) -> bool:
+    """True if `now` falls inside the user's quiet hours, in their timezone (UTC if unknown)."""
+    if not quiet:
+        return False
+    try:
+        tz = ZoneInfo(tz_name) if tz_name else timezone.utc
+    except Exception:
+        tz = timezone.utc
+    hour = datetime.fromtimestamp(now, tz=tz).hour
+    start, end = quiet
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end  # wraps past midnight
+
+
+def offsets_for(settings):
+    return (settings or {}).get("offsets") or list(REMINDER_OFFSETS)
+
+
+# --- Timer members: "user_id:contest_id:offset:start" ---
+# The start time is part of the member, so timers of a rescheduled contest
+# simply don't match any more when they fire (no need to find and delete them).
+def encode_timer(user_id, contest_id, offset, start) -> str:
+    return f"{user_id}:{contest_id}:{offset}:{start}"
+
+
+def decode_timer(member: str):
+    user_id, contest_id, offset, start = member.split(":")
+    return int(user_id), int(contest_id), int(offset), int(start)
+
+
+def plan_timers(contest, settings_by_user, now: float):
+    """Returns [(fire_at, member), ...] for every user in `settings_by_user` for one contest."""
+    start = contest["startTimeSeconds"]
+    timers = []
+    for user_id, settings in settings_by_user.items():
+        for offset in offsets_for(settings):
+            fire_at = start - offset
+            if fire_at > now:
+                timers.append((fire_at, encode_timer(user_id, contest["id"], offset, start)))
+    return timers
+
+
+def plan_user_timers(user_id, settings, contests, prefs_mask: int, now: float):
+    """Returns the timers of one user for every upcoming contest matching their prefs."""
+    timers = []
+    for c in contests:
+        if contest_tags.matches(prefs_mask, contest_tags.contest_mask(c)):
+            timers.extend(plan_timers(c, {user_id: settings}, now))
+    return timers
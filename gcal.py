@@ -0,0 +1,84 @@
+import os
+import json
+import asyncio
+import weakref
+
+from cachetools import LRUCache
+
+import bot_storage
+
+# --- Settings ---
+SERVICE_CACHE_SIZE = int(os.environ.get("CALENDAR_SERVICE_CACHE_SIZE", 2000))
+# Timezones almost never change: keep them a week, refresh in the background after a day
+TIMEZONE_TTL = int(os.environ.get("TIMEZONE_TTL", 7 * 24 * 3600))
+TIMEZONE_REFRESH_AFTER = int(os.environ.get("TIMEZONE_REFRESH_AFTER", 24 * 3600))
+
+# The Calendar discovery document ships with google-api-python-client.
+# Parsed once, on first use, instead of on every build() (or at import).
+_calendar_discovery = None
+
+# user_id -> (credentials, service)
+_services = LRUCache(maxsize=SERVICE_CACHE_SIZE)
+# httplib2 isn't thread-safe, so requests on one user's service run one at a time
+_locks = weakref.WeakValueDictionary()
+# user_id -> background timezone refresh task
+_refreshing = {}
+
+
+def get_service(user_id: int, creds):
+    """Returns a Calendar service for the user, reusing it while the creds stay the same."""
+    cached = _services.get(user_id)
+    if cached and cached[0] is creds:
+        return cached[1]
+
+    # googleapiclient is slow to import: only processes that use a calendar pay for it
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    global _calendar_discovery
+    if _calendar_discovery is None:
+        _calendar_discovery = json.loads(get_static_doc("calendar", "v3")) # type: ignore
+    service = build_from_document(_calendar_discovery, credentials=creds)
+    _services[user_id] = (creds, service)
+    return service
+
+
+async def execute(user_id: int, request):
+    """Runs a (blocking) Google API request in a thread without freezing the bot."""
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = _locks[user_id] = asyncio.Lock()
+    async with lock:
+        return await asyncio.to_thread(request.execute)
+
+
+async def _fetch_timezone(user_id: int, creds) -> str:
+    service = get_service(user_id, creds)
+    calendar_data = await execute(user_id, service.calendars().get(calendarId='primary'))
+    time_zone = calendar_data.get('timeZone', 'UTC')
+    await bot_storage.cache_timezone(user_id, time_zone, TIMEZONE_TTL)
+    return time_zone
+
+
+async def _refresh_timezone(user_id: int, creds):
+    try:
+        await _fetch_timezone(user_id, creds)
+    except Exception as e:
+        print(f"Background timezone refresh failed for {user_id}: {e}")
+    finally:
+        _refreshing.pop(user_id, None)
+
+
+async def get_timezone(user_id: int, creds) -> str:
+    """
+    Returns the user's calendar timezone from the Redis cache.
+    Old entries are served immediately and refreshed in the background;
+    Google is only asked directly on a cache miss.
+    """
+    time_zone, ttl_left = await bot_storage.get_cached_timezone(user_id)
+    if time_zone:
+        if TIMEZONE_TTL - ttl_left > TIMEZONE_REFRESH_AFTER and user_id not in _refreshing:
+            _refreshing[user_id] = asyncio.create_task(_refresh_timezone(user_id, creds))
+        return time_zone
+
+    return await _fetch_timezone(user_id, creds)
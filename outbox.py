@@ -0,0 +1,189 @@
+import os
+import time
+import socket
+import random
+import asyncio
+
+import bot_storage
+import cluster
+from broadcast import broadcaster
+
+# --- Outbox worker settings ---
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 8))
+# Messages one worker reads at a time (split across the streams it reads)
+OUTBOX_READ_COUNT = int(os.environ.get("OUTBOX_READ_COUNT", 10))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+# A message read by a worker that hasn't acked it for this long is taken over
+OUTBOX_CLAIM_IDLE_MS = int(os.environ.get("OUTBOX_CLAIM_IDLE_MS", 120_000))
+# After a rebalance, messages of a shard we just got are taken over after this grace period
+OUTBOX_REBALANCE_IDLE_MS = int(os.environ.get("OUTBOX_REBALANCE_IDLE_MS", 30_000))
+# Neither may be shorter than a send can take, or a message still being sent is sent again
+_MIN_CLAIM_IDLE_MS = int(2 * broadcaster.max_send_seconds * 1000)
+OUTBOX_BLOCK_MS = 1000
+# Broadcast progress is logged every this many delivered messages (and at the end)
+OUTBOX_PROGRESS_EVERY = int(os.environ.get("OUTBOX_PROGRESS_EVERY", 500))
+
+
+def stream_for_chat(chat_id) -> str:
+    return bot_storage.outbox_stream_key(cluster.shard_of(chat_id))
+
+
+async def enqueue(chat_ids, text: str, parse_mode: str = "Markdown", ledger_id=None):
+    """
+    Queues `text` for every chat, in the stream of the chat's shard. Delivery happens
+    in the worker pools. Returns False if the messages couldn't be queued.
+    """
+    batches = {}
+    for chat_id in chat_ids:
+        batches.setdefault(stream_for_chat(chat_id), []).append(chat_id)
+    return await bot_storage.outbox_enqueue(batches, text, parse_mode, ledger_id=ledger_id)
+
+
+async def report_progress(ledger_id, outcome: str):
+    """Counts one final outcome of a broadcast; logs the totals every OUTBOX_PROGRESS_EVERY messages and at the end."""
+    counts = await bot_storage.ledger_record_outcome(ledger_id, outcome)
+    if counts is None:
+        return
+    handled, total = counts
+    if handled % OUTBOX_PROGRESS_EVERY == 0 or handled == total:
+        progress = await bot_storage.ledger_progress(ledger_id)
+        print(f"Broadcast {ledger_id}: {handled}/{total} delivered "
+              f"(sent={progress['sent']}, blocked={progress['blocked']}, "
+              f"rejected={progress['rejected']}, failed={progress['failed']})")
+
+
+def retry_delay(attempts: int) -> float:
+    # 5s, 10s, 20s, ... capped at 10 minutes, with jitter
+    return min(600.0, 5.0 * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+class OutboxWorkerPool:
+    """
+    Async workers that consume the outbox streams of the shards this process
+    owns (see cluster.Cluster), through a consumer group.
+
+    - Sends go through the shared broadcaster (global rate limit, RetryAfter).
+    - Failed sends are retried with exponential backoff via a delayed set.
+    - Chats that blocked the bot or no longer exist are dead-lettered and
+      unsubscribed; messages that keep failing end up in the dead stream.
+    - Messages left unacknowledged by a crashed worker, or by the previous
+      owner of a shard, are claimed back.
+    - Final outcomes are counted on the broadcast's delivery ledger, and the
+      progress is logged (see report_progress).
+    """
+
+    def __init__(self, bot, workers=OUTBOX_WORKERS, name=None, shards=None):
+        self.bot = bot
+        self.workers = workers
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.shards = set(range(cluster.NUM_SHARDS)) if shards is None else set(shards)
+        self._new_shards = {}  # shard -> until when its stale messages are claimed with the short grace
+        self._tasks = []
+        self._stopping = False
+
+    def set_shards(self, shards):
+        """Called on rebalance: from now on only these shards are consumed."""
+        shards = set(shards)
+        until = time.time() + OUTBOX_CLAIM_IDLE_MS / 1000
+        for shard in shards - self.shards:
+            self._new_shards[shard] = until
+        self.shards = shards
+
+    def _stream_keys(self):
+        return [bot_storage.outbox_stream_key(s) for s in sorted(self.shards)]
+
+    async def start(self):
+        await bot_storage.outbox_ensure_groups(bot_storage.outbox_stream_key(s) for s in range(cluster.NUM_SHARDS))
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker(f"{self.name}-{i}", i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        print(f"Outbox started with {self.workers} workers ({self.name}).")
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _handle(self, stream_key, consumer, message_id, fields):
+        chat_id = int(fields["chat_id"])
+        if cluster.shard_of(chat_id) not in self.shards:
+            return  # shard moved to another worker: leave it pending, the new owner claims it
+        if not await bot_storage.outbox_touch(stream_key, consumer, message_id):
+            return  # claimed by another consumer while it waited in our batch
+
+        attempts = int(fields.get("attempts", 0)) + 1
+        outcome = await broadcaster.send_one(
+            self.bot, chat_id, fields["text"], parse_mode=fields.get("parse_mode") or None
+        )
+
+        if outcome == "throttled":
+            # Telegram's flood wait, not this message's fault: doesn't count as an attempt
+            ready_at = time.time() + broadcaster.throttle_remaining() + random.uniform(0, 5)
+            await bot_storage.outbox_retry_later(stream_key, message_id, fields, ready_at)
+            return
+        if outcome == "sent":
+            await bot_storage.outbox_ack(stream_key, message_id)
+        elif outcome == "blocked":
+            await bot_storage.outbox_dead_letter(stream_key, message_id, fields, "blocked", dead_chat=True)
+        elif outcome == "rejected" or attempts >= OUTBOX_MAX_ATTEMPTS:
+            await bot_storage.outbox_dead_letter(stream_key, message_id, fields, outcome, dead_chat=False)
+        else:
+            fields = {**fields, "attempts": attempts}
+            await bot_storage.outbox_retry_later(stream_key, message_id, fields, time.time() + retry_delay(attempts))
+            return  # not final yet
+
+        if fields.get("ledger_id"):
+            await report_progress(fields["ledger_id"], outcome)
+
+    def _worker_stream_keys(self, index: int):
+        """
+        The streams worker `index` reads: every worker gets its own share of the shards
+        (or shares one stream with others, if there are more workers than shards).
+        XREADGROUP's COUNT is per stream, so reading every stream at once would hand one
+        worker up to COUNT messages of each shard, to send one by one, while the rest idle.
+        """
+        stream_keys = self._stream_keys()
+        if not stream_keys:
+            return []
+        return stream_keys[index::self.workers] or [stream_keys[index % len(stream_keys)]]
+
+    async def _worker(self, consumer: str, index: int):
+        while not self._stopping:
+            try:
+                # The blocking read only holds one pooled connection, not the event loop
+                stream_keys = self._worker_stream_keys(index)
+                count = max(1, OUTBOX_READ_COUNT // max(1, len(stream_keys)))
+                messages = await bot_storage.outbox_read(consumer, stream_keys, count, OUTBOX_BLOCK_MS)
+                for stream_key, message_id, fields in messages:
+                    await self._handle(stream_key, consumer, message_id, fields)
+                if not messages and (not bot_storage.r or not stream_keys):
+                    await asyncio.sleep(OUTBOX_BLOCK_MS / 1000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox worker {consumer} error: {e}")
+                await asyncio.sleep(1)
+
+    async def _maintenance(self):
+        """Re-queues retries whose backoff is over and rescues messages of dead consumers / moved shards."""
+        consumer = f"{self.name}-claim"
+        while not self._stopping:
+            try:
+                await bot_storage.outbox_promote_due(time.time(), lambda fields: stream_for_chat(fields["chat_id"]))
+
+                now = time.time()
+                self._new_shards = {s: until for s, until in self._new_shards.items() if until > now}
+                for shard in sorted(self.shards):
+                    stream_key = bot_storage.outbox_stream_key(shard)
+                    idle_ms = OUTBOX_REBALANCE_IDLE_MS if shard in self._new_shards else OUTBOX_CLAIM_IDLE_MS
+                    idle_ms = max(idle_ms, _MIN_CLAIM_IDLE_MS)
+                    for message_id, fields in await bot_storage.outbox_claim_stale(stream_key, consumer, idle_ms, 50):
+                        if fields:  # deleted entries come back empty
+                            await self._handle(stream_key, consumer, message_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox maintenance error: {e}")
+            await asyncio.sleep(5)
@@ -0,0 +1,33 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Async token bucket.
+
+    `rate` tokens are added per second, up to `capacity`.
+    `acquire()` waits until a token is available, so callers are spread out
+    evenly instead of bursting into the remote API.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        # The lock makes waiters queue up in order (FIFO)
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
@@ -0,0 +1,95 @@
+import os
+import time
+from datetime import datetime, timezone
+
+from apscheduler.jobstores.base import JobLookupError
+
+# --- Reminder offsets (seconds before the contest starts) ---
+# e.g. REMINDER_OFFSETS="86400,3600,600" -> 1 day, 1 hour and 10 minutes before
+REMINDER_OFFSETS = tuple(
+    int(x) for x in os.environ.get("REMINDER_OFFSETS", "86400,3600,600").split(",") if x.strip()
+)
+# A reminder whose time passed less than this long ago (e.g. while the leader
+# was changing) is still sent right away; the delivery ledger prevents doubles
+REMINDER_GRACE = int(os.environ.get("REMINDER_GRACE", 300))
+
+
+def format_offset(seconds: int) -> str:
+    """86400 -> '1 day', 5400 -> '1 hour 30 minutes'."""
+    parts = []
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        amount, seconds = divmod(seconds, size)
+        if amount:
+            parts.append(f"{amount} {unit}{'s' if amount > 1 else ''}")
+    return " ".join(parts) or "less than a minute"
+
+
+class ReminderScheduler:
+    """
+    Keeps exactly one run_once job per (contest, offset) on the JobQueue.
+
+    sync() is called whenever the contest list is refreshed and only touches
+    the jobs of contests that were added, removed or rescheduled, so between
+    contests there is nothing to do.
+    """
+
+    def __init__(self, callback, offsets=REMINDER_OFFSETS, grace=REMINDER_GRACE):
+        # callback(context) gets job.data == {"contest_id": ..., "offset": ..., "start": ...}
+        self.callback = callback
+        self.offsets = offsets
+        self.grace = grace
+        self._starts = {}  # contest_id -> startTimeSeconds the jobs were built for
+        self._jobs = {}    # contest_id -> [(fire time, Job), ...] still pending
+
+    def _cancel(self, contest_id):
+        for _, job in self._jobs.pop(contest_id, []):
+            if job.removed:
+                continue
+            try:
+                job.schedule_removal()
+            except JobLookupError:
+                pass  # it fired (or was removed) in the meantime
+        self._starts.pop(contest_id, None)
+
+    def _forget_fired(self, now):
+        # run_once jobs that ran are gone from the JobQueue: drop their handles too
+        for contest_id, jobs in self._jobs.items():
+            self._jobs[contest_id] = [(t, job) for t, job in jobs if t > now]
+
+    def _schedule(self, job_queue, contest, now):
+        contest_id = contest["id"]
+        start = contest["startTimeSeconds"]
+        jobs = []
+        for offset in self.offsets:
+            fire_at = start - offset
+            if fire_at <= now - self.grace or start <= now:
+                continue  # too late for this one
+            fire_at = max(fire_at, now)
+            jobs.append((fire_at, job_queue.run_once(
+                self.callback,
+                when=datetime.fromtimestamp(fire_at, tz=timezone.utc),
+                name=f"reminder:{contest_id}:{offset}",
+                data={"contest_id": contest_id, "offset": offset, "start": start},
+            )))
+        self._jobs[contest_id] = jobs
+        self._starts[contest_id] = start
+
+    def sync(self, job_queue, contests):
+        """Brings the scheduled jobs in line with `contests`. Returns how many contests changed."""
+        now = time.time()
+        current = {c["id"]: c for c in contests}
+        changed = set()
+        self._forget_fired(now)
+
+        for contest_id in list(self._starts):
+            contest = current.get(contest_id)
+            if contest is None or contest["startTimeSeconds"] != self._starts[contest_id]:
+                self._cancel(contest_id)
+                changed.add(contest_id)
+
+        for contest_id, contest in current.items():
+            if contest_id not in self._starts:
+                self._schedule(job_queue, contest, now)
+                changed.add(contest_id)
+
+        return len(changed)
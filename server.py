@@ -1,9 +1,13 @@
 import os
 import json
+import asyncio
 import secrets
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Header, HTTPException
 from fastapi.responses import RedirectResponse, HTMLResponse
-from google_auth_oauthlib.flow import Flow
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # --- Import your new storage file ---
@@ -24,28 +28,89 @@ SCOPES = [
 ]
 # This MUST be your public server URL (from Render, not localhost)
 REDIRECT_URL = f"{FASTAPI_SERVER_URL}/oauth2callback"
+# Upper bound for one /get-user-tokens request
+MAX_TOKEN_BATCH = 500
+# The token exchange with Google is a blocking HTTPS call: it runs in this many threads
+TOKEN_EXCHANGE_WORKERS = int(os.getenv("TOKEN_EXCHANGE_WORKERS", 8))
+TOKEN_EXCHANGE_TIMEOUT = int(os.getenv("TOKEN_EXCHANGE_TIMEOUT", 15))
+
+# Parsed once; every Flow is built from this
+CLIENT_CONFIG = {
+    "web": {
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET,
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "redirect_uris": [REDIRECT_URL],
+    }
+}
+
+token_executor = ThreadPoolExecutor(max_workers=TOKEN_EXCHANGE_WORKERS, thread_name_prefix="token-exchange")
+
+# --- Telegram webhook mode (optional) ---
+# With BOT_WEBHOOK=1 this server also runs the bot: Telegram POSTs updates to
+# WEBHOOK_PATH instead of the bot polling getUpdates (run codeforces.py with BOT_POLLING=0 then).
+BOT_WEBHOOK = os.getenv("BOT_WEBHOOK", "0") == "1"
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 32))        # updates handled at once
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)) # Telegram -> us
+
+bot_application = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global bot_application
+    await server_storage.check_connection()
+    if not BOT_WEBHOOK:
+        yield
+        token_executor.shutdown(wait=False, cancel_futures=True)
+        await server_storage.aclose()
+        return
+
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET is required when BOT_WEBHOOK=1")
+
+    # Imported here so the plain auth server doesn't load the whole bot
+    from telegram import Update
+    import codeforces
+
+    bot_application = codeforces.build_application(concurrent_updates=WEBHOOK_CONCURRENCY)
+    await codeforces.start_application(bot_application)
+    await bot_application.bot.set_webhook(
+        url=f"{FASTAPI_SERVER_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    print(f"Telegram webhook set to {FASTAPI_SERVER_URL}{WEBHOOK_PATH}")
+    try:
+        yield
+    finally:
+        await codeforces.stop_application(bot_application)
+        bot_application = None
+        token_executor.shutdown(wait=False, cancel_futures=True)
+        await server_storage.aclose()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # --- DELETED REDUNDANT CODE ---
 # The Redis connection (r) and KEY definitions
 # are now correctly handled inside server_storage.py
 # ------------------------------
 
-def create_flow():
-    """Creates a new Google OAuth Flow instance."""
-    return Flow.from_client_config(
-        {
-            "web": {
-                "client_id": CLIENT_ID,
-                "client_secret": CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [REDIRECT_URL],
-            }
-        },
-        scopes=SCOPES
-    )
+def create_flow(code_verifier=None):
+    """
+    Creates a new Google OAuth Flow instance (a Flow holds per-login state, so it isn't shared).
+    The callback passes the PKCE code verifier generated for the same login in /connect.
+    """
+    # Imported on first use: the webhook / health endpoints don't need the OAuth libraries
+    from google_auth_oauthlib.flow import Flow
+    flow = Flow.from_client_config(CLIENT_CONFIG, scopes=SCOPES, code_verifier=code_verifier)
+    flow.redirect_uri = REDIRECT_URL
+    return flow
 
 @app.get("/")
 async def root():
@@ -54,16 +119,16 @@ async def root():
 @app.get("/connect")
 # --- FIX: Changed user_id: str to user_id: int to match the bot ---
 async def connect(token: str, user_id: int):
-    # Use the storage function
-    server_storage.save_pending_auth(token, user_id)
-    
     flow = create_flow()
-    flow.redirect_uri = REDIRECT_URL
     auth_url, _ = flow.authorization_url(
         access_type="offline",
         include_granted_scopes="true",
         state=token
     )
+
+    # Use the storage function. The code verifier goes to Redis too, so the
+    # callback can land on any server worker
+    await server_storage.save_pending_auth(token, user_id, flow.code_verifier)
     return RedirectResponse(auth_url)
 
 @app.get("/oauth2callback")
@@ -73,16 +138,18 @@ async def oauth2callback(request: Request):
     token = params.get("state")
 
     # Use the storage function
-    user_id_int = server_storage.pop_pending_auth(token)
+    user_id_int, code_verifier = await server_storage.pop_pending_auth(token)
 
     if not user_id_int:
         return HTMLResponse(content="<h1>Error: Invalid or expired auth token.</h1><p>Please try connecting from Telegram again.</p>")
 
-    flow = create_flow()
-    flow.redirect_uri = REDIRECT_URL
+    flow = create_flow(code_verifier)
     
     try:
-        flow.fetch_token(code=code)
+        # Off the event loop: a slow Google response must not hold up other requests
+        await asyncio.get_running_loop().run_in_executor(
+            token_executor, partial(flow.fetch_token, code=code, timeout=TOKEN_EXCHANGE_TIMEOUT)
+        )
     except Exception as e:
         print(f"Error fetching token for user {user_id_int}: {e}")
         return HTMLResponse(content="<h1>Error: Failed to fetch token from Google.</h1>")
@@ -99,7 +166,7 @@ async def oauth2callback(request: Request):
     }
     
     # Use the storage function
-    server_storage.save_token_for_user(user_id_int, token_data)
+    await server_storage.save_token_for_user(user_id_int, token_data)
     
     print(f"✅ [AUTH SUCCESS] Token saved for user: {user_id_int}")
     return HTMLResponse(content="<h2>✅ Google Calendar connected!</h2><p>You can close this tab.</p>")
@@ -110,10 +177,45 @@ async def get_single_token(user_id: int, x_api_key: str = Header(None)):
     if x_api_key != Internal_API_KEY:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    # Use the storage function
-    token_data = server_storage.load_tokens().get(user_id)
+    # Only this user's field is read (HGET), not the whole hash
+    token_data = await server_storage.load_token_for_user(user_id)
 
     if not token_data:
         raise HTTPException(status_code=404, detail="Token not found")
 
-    return token_data
\ No newline at end of file
+    return token_data
+
+
+class TokenBatchRequest(BaseModel):
+    user_ids: list[int]
+
+
+@app.post("/get-user-tokens")
+async def get_many_tokens(body: TokenBatchRequest, x_api_key: str = Header(None)):
+    """Batched lookup for bulk jobs. Users without a token are left out of the result."""
+    if x_api_key != Internal_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    if len(body.user_ids) > MAX_TOKEN_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_TOKEN_BATCH} user_ids per request")
+
+    tokens = await server_storage.load_tokens_for_users(body.user_ids)
+    return {str(user_id): token_data for user_id, token_data in tokens.items()}
+
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: str = Header(None)):
+    """Receives one Telegram update and hands it to the bot's update queue."""
+    if not bot_application:
+        raise HTTPException(status_code=404, detail="Webhook mode is not enabled")
+
+    if not x_telegram_bot_api_secret_token or not secrets.compare_digest(
+        x_telegram_bot_api_secret_token, WEBHOOK_SECRET # type: ignore
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    from telegram import Update
+    update = Update.de_json(await request.json(), bot_application.bot)
+    # Answer right away; the Application processes queued updates concurrently
+    await bot_application.update_queue.put(update)
+    return {"ok": True}
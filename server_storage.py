@@ -1,34 +1,53 @@
 import os
 import json
 import redis
+import redis.asyncio as aioredis
+
+from autopipeline import AutoPipeline
 
 # --- Connect to Redis ---
 # Render will automatically provide this environment variable
 REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
 
 if not REDIS_URL:
     print("WARNING (Server): REDIS_URL not found. Defaulting to localhost.")
     REDIS_URL = "redis://localhost:6379"
 
-try:
-    # This (r) is your one connection to the Redis database
-    # decode_responses=True makes it return strings, not bytes
-    r = redis.from_url(REDIS_URL, decode_responses=True)
-    r.ping()
-    print("Connected to Redis (Server) successfully!")
-except redis.exceptions.ConnectionError as e: # type: ignore
-    print(f"FATAL (Server): Could not connect to Redis. {e}")
-    r = None # Set to None so other functions don't crash
+# This (r) is your one (async) connection pool to the Redis database
+# decode_responses=True makes it return strings, not bytes.
+# Nothing connects until the first command; check_connection() runs at startup.
+r = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, timeout=10, decode_responses=True
+))
+
+# Single commands issued at the same time share one round trip (see autopipeline.py)
+auto = AutoPipeline(r)
+
+
+async def check_connection() -> bool:
+    """Pings Redis once at startup. If it can't be reached, storage is disabled (r = None)."""
+    global r, auto
+    if not r: return False
+    try:
+        await r.ping()
+        print("Connected to Redis (Server) successfully!")
+        return True
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e: # type: ignore
+        print(f"FATAL (Server): Could not connect to Redis. {e}")
+        await r.aclose()
+        r = auto = None # Set to None so other functions don't crash
+        return False
 
 # --- We will store all data in Redis Hashes ---
 TOKENS_KEY = "user_tokens"
 PENDING_KEY = "pending_auth"
 
-def load_tokens():
+async def load_tokens():
     """Loads all user tokens from Redis."""
     if not r: return {}
     try:
-        tokens_raw = r.hgetall(TOKENS_KEY)
+        tokens_raw = await auto.hgetall(TOKENS_KEY)
         tokens = {}
         for user_id, token_json in tokens_raw.items(): # type: ignore
             tokens[int(user_id)] = json.loads(token_json)
@@ -37,47 +56,81 @@ def load_tokens():
         print(f"Error loading tokens from Redis: {e}")
         return {}
 
-def save_token_for_user(user_id, token_data):
+async def load_token_for_user(user_id):
+    """Loads a single user's token from Redis (one HGET), or None."""
+    if not r: return None
+    try:
+        token_json = await auto.hget(TOKENS_KEY, str(user_id))
+        return json.loads(token_json) if token_json else None # type: ignore
+    except Exception as e:
+        print(f"Error loading token for {user_id} from Redis: {e}")
+        return None
+
+async def load_tokens_for_users(user_ids):
+    """Loads the tokens of many users with one HMGET. Returns {user_id: token_data}."""
+    user_ids = list(user_ids)
+    if not r or not user_ids: return {}
+    try:
+        tokens_raw = await auto.hmget(TOKENS_KEY, [str(u) for u in user_ids])
+        return {int(u): json.loads(t) for u, t in zip(user_ids, tokens_raw) if t} # type: ignore
+    except Exception as e:
+        print(f"Error loading tokens in bulk from Redis: {e}")
+        return {}
+
+async def save_token_for_user(user_id, token_data):
     """Saves a single user's token to Redis."""
     if not r: return
     try:
-        r.hset(TOKENS_KEY, str(user_id), json.dumps(token_data))
+        await auto.hset(TOKENS_KEY, str(user_id), json.dumps(token_data))
     except Exception as e:
         print(f"Error saving token to Redis: {e}")
 
-def load_pending():
+async def load_pending():
     """Loads all pending auths from Redis."""
     if not r: return {}
     try:
-        pending_raw = r.hgetall(PENDING_KEY)
+        pending_raw = await auto.hgetall(PENDING_KEY)
         # Keys are strings (tokens), values are int (user_ids)
         return {token: int(user_id) for token, user_id in pending_raw.items()} # type: ignore
     except Exception as e:
         print(f"Error loading pending auths from Redis: {e}")
         return {}
 
-def save_pending_auth(token, user_id):
-    """Saves a single pending auth token to Redis."""
+async def save_pending_auth(token, user_id, code_verifier=None):
+    """Saves a single pending auth token (and its PKCE code verifier) to Redis."""
     if not r: return
     try:
-        # Use r.set() instead of hset() for a simple key:value with expiry
+        # Use set() instead of hset() for a simple key:value with expiry
         # 900 seconds = 15 minutes
-        r.set(f"{PENDING_KEY}:{token}", str(user_id), ex=900)
+        pending = json.dumps({"user_id": int(user_id), "code_verifier": code_verifier})
+        await auto.set(f"{PENDING_KEY}:{token}", pending, ex=900)
     except Exception as e:
         print(f"Error saving pending auth to Redis: {e}")
 
-def pop_pending_auth(token):
-    """Retrieves and deletes a pending auth token from Redis."""
-    if not r: return None
+async def pop_pending_auth(token):
+    """
+    Retrieves and deletes a pending auth token from Redis.
+    Returns (user_id, code_verifier), or (None, None). Any worker can pop it, but only once.
+    """
+    if not r: return None, None
     try:
-        # Use r.get() to fetch the key
+        # GET + DEL in one transaction, so two callbacks can't both use the token
         key = f"{PENDING_KEY}:{token}"
-        user_id = r.get(key)
-        
-        if user_id:
-            r.delete(key) # Delete the key
-            return int(user_id) # type: ignore
-        return None
+        pipe = r.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        pending, _ = await pipe.execute()
+
+        if not pending:
+            return None, None
+        if pending.isdigit():
+            return int(pending), None  # saved before the code verifier was stored
+        pending = json.loads(pending)
+        return int(pending["user_id"]), pending.get("code_verifier")
     except Exception as e:
         print(f"Error popping pending auth from Redis: {e}")
-        return None
\ No newline at end of file
+        return None, None
+
+async def aclose():
+    if r:
+        await r.aclose()
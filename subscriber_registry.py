@@ -0,0 +1,119 @@
+import sys
+import zlib
+import base64
+import binascii
+import struct
+from array import array
+from bisect import bisect_left
+
+# --- Snapshot format ---
+# header: magic, format version, count; then the IDs (int64) and the masks (uint16),
+# little-endian, zlib-compressed (and base64'd for Redis)
+_MAGIC = b"SUBR"
+_FORMAT = 1
+_HEADER = struct.Struct("<4sBQ")
+
+
+class SubscriberRegistry:
+    """
+    Every subscriber (as an int) with their preference bitmask (see contest_tags),
+    in two parallel arrays sorted by user ID: 10 bytes per user instead of a
+    Python set of strings plus a dict.
+
+    - Membership is a binary search; it's what /start checks before touching Redis.
+    - Adding/removing one user shifts the arrays (a memmove, fine for single updates).
+
+    Reminder and announcement fan-out doesn't use it: that goes through the
+    Redis prefs index (bot_storage.get_subscribers_for_tags), which also
+    skips dead chats. The masks are kept in the snapshot format all the same.
+    """
+
+    def __init__(self, ids=(), masks=()):
+        self._ids = array("q", ids)
+        self._masks = array("H", masks)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Builds the registry from (user_id, mask) pairs in any order; the last mask of a duplicate wins."""
+        by_id = {int(user_id): mask for user_id, mask in pairs}
+        ids = sorted(by_id)
+        return cls(ids, [by_id[u] for u in ids])
+
+    def _find(self, user_id: int) -> int:
+        i = bisect_left(self._ids, user_id)
+        return i if i < len(self._ids) and self._ids[i] == user_id else -1
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, user_id):
+        return self._find(int(user_id)) >= 0
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def set(self, user_id, mask: int):
+        """Adds a subscriber, or updates their mask."""
+        user_id = int(user_id)
+        i = bisect_left(self._ids, user_id)
+        if i < len(self._ids) and self._ids[i] == user_id:
+            self._masks[i] = mask
+        else:
+            self._ids.insert(i, user_id)
+            self._masks.insert(i, mask)
+
+    def discard(self, user_id):
+        i = self._find(int(user_id))
+        if i >= 0:
+            del self._ids[i]
+            del self._masks[i]
+
+    def copy(self):
+        return SubscriberRegistry(self._ids, self._masks)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._ids) * self._ids.itemsize + len(self._masks) * self._masks.itemsize
+
+    # --- Snapshot ---
+    def to_bytes(self) -> bytes:
+        ids, masks = array("q", self._ids), array("H", self._masks)
+        if sys.byteorder == "big":
+            ids.byteswap()
+            masks.byteswap()
+        header = _HEADER.pack(_MAGIC, _FORMAT, len(ids))
+        return zlib.compress(header + ids.tobytes() + masks.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """Loads a snapshot made by to_bytes(). Raises ValueError if it isn't one."""
+        try:
+            raw = zlib.decompress(data)
+            magic, version, count = _HEADER.unpack_from(raw)
+        except (zlib.error, struct.error) as e:
+            raise ValueError(f"Corrupt subscriber registry snapshot: {e}") from e
+        if magic != _MAGIC or version != _FORMAT:
+            raise ValueError("Not a subscriber registry snapshot")
+
+        registry = cls()
+        start = _HEADER.size
+        registry._ids.frombytes(raw[start:start + count * 8])
+        registry._masks.frombytes(raw[start + count * 8:start + count * 10])
+        if sys.byteorder == "big":
+            registry._ids.byteswap()
+            registry._masks.byteswap()
+        if len(registry._ids) != count or len(registry._masks) != count:
+            raise ValueError("Truncated subscriber registry snapshot")
+        return registry
+
+    def to_text(self) -> str:
+        """to_bytes() as ASCII, for string-only stores (our Redis client decodes responses)."""
+        return base64.b64encode(self.to_bytes()).decode()
+
+    @classmethod
+    def from_text(cls, text: str):
+        try:
+            data = base64.b64decode(text, validate=True)
+        except (binascii.Error, TypeError) as e:
+            raise ValueError(f"Corrupt subscriber registry snapshot: {e}") from e
+        return cls.from_bytes(data)
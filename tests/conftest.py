@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Points bot_storage (client, auto-pipeline and Lua scripts) at an in-process fakeredis."""
+    fakeredis = pytest.importorskip("fakeredis")
+    import bot_storage
+    from autopipeline import AutoPipeline
+
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(bot_storage, "r", client)
+    monkeypatch.setattr(bot_storage, "auto", AutoPipeline(client))
+    for name in dir(bot_storage):
+        if name.startswith("_") and name.endswith("_script"):
+            lua = getattr(bot_storage, "_" + name[1:-len("_script")].upper() + "_LUA")
+            monkeypatch.setattr(bot_storage, name, client.register_script(lua))
+    return client
@@ -0,0 +1,116 @@
+import os
+import gzip
+import json
+import random
+import asyncio
+
+import httpx
+import pytest
+
+import cf_client
+from cf_client import CodeforcesAPIError, iter_json_array
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "contest_list.json.gz")
+
+# Strings with the characters the parser has to skip over or must not be fooled by
+TRICKY_BODY = (
+    '{"status":"OK","result":['
+    '{"id":1,"name":"Round ] with, \\"quotes\\" and \\\\ backslash","phase":"BEFORE"},'
+    ' {"id":2,"name":"Ünïcode — 名前","nested":{"a":[1,2,{"b":"]}"}]},"phase":"CODING"} ,\n'
+    '{"id":3,"name":"\\"result\\": [fake]","phase":"FINISHED"}'
+    ']}'
+)
+
+
+async def _chunks(pieces):
+    for piece in pieces:
+        yield piece
+
+
+def parse(pieces):
+    async def collect():
+        return [item async for item in iter_json_array(_chunks(pieces))]
+    return asyncio.run(collect())
+
+
+def load_fixture() -> str:
+    with gzip.open(FIXTURE, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("split", range(len(TRICKY_BODY) + 1))
+def test_every_chunk_boundary(split):
+    expected = json.loads(TRICKY_BODY)["result"]
+    assert parse([TRICKY_BODY[:split], TRICKY_BODY[split:]]) == expected
+
+
+def test_one_character_chunks():
+    assert parse(list(TRICKY_BODY)) == json.loads(TRICKY_BODY)["result"]
+
+
+def test_pretty_printed_body():
+    body = json.dumps(json.loads(TRICKY_BODY), indent=2)
+    assert parse([body[i:i + 7] for i in range(0, len(body), 7)]) == json.loads(body)["result"]
+
+
+def test_fixture_with_random_chunk_sizes():
+    body = load_fixture()
+    expected = json.loads(body)["result"]
+    rng = random.Random(0)
+    for _ in range(5):
+        pieces, i = [], 0
+        while i < len(body):
+            size = rng.randint(1, 5000)
+            pieces.append(body[i:i + size])
+            i += size
+        assert parse(pieces) == expected
+
+
+def test_empty_result():
+    assert parse(['{"status":"OK","res', 'ult":[ ]}']) == []
+
+
+def test_failed_status_without_result():
+    with pytest.raises(CodeforcesAPIError, match="limit exceeded"):
+        parse(['{"status":"FAILED","comm', 'ent":"Call limit exceeded"}'])
+
+
+def test_failed_status_before_result():
+    with pytest.raises(CodeforcesAPIError):
+        parse(['{"status":"FAILED","result":[{"id":1}]}'])
+
+
+def test_truncated_body():
+    with pytest.raises(ValueError):
+        parse([TRICKY_BODY[:60]])
+    with pytest.raises(ValueError):
+        parse([TRICKY_BODY[:-2]])  # every element complete, array never closed
+
+
+def test_fetch_upcoming_stops_early(monkeypatch):
+    body = load_fixture().encode()
+    sent = []
+
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for i in range(0, len(body), 4096):
+                sent.append(i)
+                yield body[i:i + 4096]
+
+    client = cf_client.CodeforcesClient(rate=1000)
+    client._client = httpx.AsyncClient(
+        base_url=cf_client.API_BASE_URL,
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=Body())),
+    )
+    monkeypatch.setattr(cf_client, "client", client)
+
+    async def fetch():
+        try:
+            return await cf_client.fetch_upcoming_contests()
+        finally:
+            await client.aclose()
+
+    expected = sorted((c for c in json.loads(body)["result"] if c["phase"] == "BEFORE"),
+                      key=lambda c: c["startTimeSeconds"])
+    assert asyncio.run(fetch()) == expected
+    assert len(sent) * 4096 < len(body) / 10  # only the head of the list was downloaded
@@ -0,0 +1,143 @@
+import json
+import time
+import asyncio
+
+import bot_storage
+import codeforces
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_failed_enqueue_leaves_the_ledger_running(fake_redis, monkeypatch):
+    monkeypatch.setattr(codeforces.bot_cluster, "is_leader", True)
+    queued = []
+
+    async def enqueue(chat_ids, text, parse_mode=None, ledger_id=None):
+        if len(queued) == 1:
+            return False  # the second batch hits a Redis error
+        queued.append(list(chat_ids))
+        return await bot_storage.outbox_enqueue({"outbox:0": list(chat_ids)}, text, ledger_id=ledger_id)
+
+    monkeypatch.setattr(codeforces.outbox, "enqueue", enqueue)
+    monkeypatch.setattr(codeforces, "OUTBOX_BATCH_SIZE", 2)
+
+    async def scenario():
+        assert await codeforces.deliver_broadcast("L", [1, 2, 3, 4], "hi")
+        ledger = await bot_storage.ledger_load("L")
+        assert ledger["status"] == "running"
+        assert ledger["done"] == {1, 2}
+        assert "L" in await bot_storage.load_set_from_file(bot_storage.LEDGER_RUNNING_KEY)
+    run(scenario())
+
+
+def test_nothing_recorded_when_the_ledger_cannot_start(fake_redis, monkeypatch):
+    monkeypatch.setattr(codeforces.bot_cluster, "is_leader", True)
+
+    async def broken_begin(ledger_id, recipients, text):
+        return None
+
+    monkeypatch.setattr(bot_storage, "ledger_begin", broken_begin)
+    assert run(codeforces.deliver_broadcast("L", [1], "hi")) is False
+
+
+def test_subscriber_lookup_error_is_not_an_empty_audience(fake_redis, monkeypatch):
+    async def broken_execute(self, *args, **kwargs):
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(type(fake_redis.pipeline()), "execute", broken_execute)
+    assert run(bot_storage.get_subscribers_for_tags(["div2"])) is None
+
+
+def test_identical_retries_are_all_promoted(fake_redis):
+    fields = {"chat_id": "5", "text": "hi", "parse_mode": "Markdown", "attempts": 2}
+
+    async def scenario():
+        await bot_storage.outbox_retry_later("outbox:1", "1-0", fields, 10)
+        await bot_storage.outbox_retry_later("outbox:1", "2-0", fields, 10)
+        assert await bot_storage.outbox_promote_due(20, lambda f: "outbox:1") == 2
+        assert [entry for _, entry in await fake_redis.xrange("outbox:1")] == [{**fields, "attempts": "2"}] * 2
+        assert await fake_redis.zcard(bot_storage.OUTBOX_DELAYED_KEY) == 0
+    run(scenario())
+
+
+def test_fan_out_skips_dead_chats(fake_redis):
+    async def scenario():
+        await fake_redis.sadd(bot_storage.SUBSCRIBERS_KEY, "1", "2", "3")
+        await fake_redis.sadd(bot_storage.NO_PREFS_KEY, "1", "2", "3")
+        await fake_redis.sadd(bot_storage.CUSTOM_REMINDER_USERS_KEY, "3")
+        await fake_redis.sadd(bot_storage.DEAD_CHATS_KEY, "2")
+        assert await bot_storage.get_subscribers_for_tags([]) == {1, 3}
+        assert await bot_storage.get_subscribers_for_tags([], not_in=bot_storage.CUSTOM_REMINDER_USERS_KEY) == {1}
+        assert await bot_storage.get_subscribers_for_tags([], only_in=bot_storage.CUSTOM_REMINDER_USERS_KEY) == {3}
+        await bot_storage.revive_chat(2)
+        assert await bot_storage.get_subscribers_for_tags([]) == {1, 2, 3}
+    run(scenario())
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.error:
+            raise self.error
+        self.sent.append(chat_id)
+
+
+async def _read_one(chat_id, consumer):
+    stream_key = codeforces.outbox.stream_for_chat(chat_id)
+    await bot_storage.outbox_ensure_groups([stream_key])
+    await bot_storage.outbox_enqueue({stream_key: [chat_id]}, "hi", "Markdown")
+    [(_, message_id, fields)] = await bot_storage.outbox_read(consumer, [stream_key], 10, 0)
+    return stream_key, message_id, fields
+
+
+def test_message_claimed_by_another_consumer_is_not_sent_again(fake_redis):
+    bot = FakeBot()
+    pool = codeforces.outbox.OutboxWorkerPool(bot, name="a")
+
+    async def scenario():
+        stream_key, message_id, fields = await _read_one(5, "a-0")
+        await bot_storage.outbox_claim_stale(stream_key, "b-claim", 0, 10)  # the shard's new owner took it
+        await pool._handle(stream_key, "a-0", message_id, fields)
+        assert bot.sent == []
+        [pending] = await fake_redis.xpending_range(stream_key, bot_storage.OUTBOX_GROUP, "-", "+", 10)
+        assert pending["consumer"] == "b-claim"
+    run(scenario())
+
+
+def test_long_flood_wait_hands_the_message_back(fake_redis, monkeypatch):
+    from telegram.error import RetryAfter
+    from broadcast import Broadcaster
+
+    sender = Broadcaster(rate=1000, max_retry_after=10)
+    monkeypatch.setattr(codeforces.outbox, "broadcaster", sender)
+    pool = codeforces.outbox.OutboxWorkerPool(FakeBot(RetryAfter(600)), name="a")
+
+    async def scenario():
+        stream_key, message_id, fields = await _read_one(5, "a-0")
+        await asyncio.wait_for(pool._handle(stream_key, "a-0", message_id, fields), 1)
+        [(member, ready_at)] = await fake_redis.zrange(bot_storage.OUTBOX_DELAYED_KEY, 0, -1, withscores=True)
+        assert json.loads(member)["fields"]["attempts"] == "0"
+        assert ready_at >= time.time() + 590
+        assert await sender.send_one(FakeBot(), 6, "hi") == "throttled"
+    run(scenario())
+
+
+def test_claim_windows_outlast_a_send():
+    from outbox import _MIN_CLAIM_IDLE_MS
+    from broadcast import broadcaster
+    assert _MIN_CLAIM_IDLE_MS > broadcaster.max_send_seconds * 1000
+
+
+def test_workers_split_the_shard_streams():
+    pool = codeforces.outbox.OutboxWorkerPool(FakeBot(), workers=8, name="a", shards=range(16))
+    shares = [pool._worker_stream_keys(i) for i in range(8)]
+    assert all(len(keys) == 2 for keys in shares)
+    assert sorted(k for keys in shares for k in keys) == sorted(pool._stream_keys())
+
+    pool.set_shards([3, 7])
+    assert {tuple(pool._worker_stream_keys(i)) for i in range(8)} == {(k,) for k in pool._stream_keys()}